@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# command_parse.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Time Players.parse_command against one filters.command per command.
+
+Before parse_command, every group and owner message ran the filters of each
+command handler in turn, this is that cost against a single parse and dict
+lookup.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyrogram import filters  # noqa: E402
+
+from player import Players  # noqa: E402
+from simulator import FakeMessage  # noqa: E402
+
+COMMANDS = ["resend", "off", "setw"]
+USERNAME = "WerewolfHelperBot"
+# Mostly chatter, a few commands, as seen in a monitored group
+TEXTS = [
+    "good morning",
+    "who is the seer?",
+    "/resend werewolf3",
+    "/setw 3",
+    "/start@OtherBot",
+    "lol",
+    "/off",
+    "vote 3 please",
+]
+
+
+async def with_filters(rounds: int) -> float:
+    client = SimpleNamespace(me=SimpleNamespace(username=USERNAME))
+    command_filters = [filters.command(x) for x in COMMANDS]
+    messages = [FakeMessage(None, -1, 1, x) for x in TEXTS]
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        for msg in messages:
+            for command_filter in command_filters:
+                if await command_filter(client, msg):
+                    break
+    return (time.perf_counter() - started_at) / rounds / len(TEXTS)
+
+
+def with_parse(rounds: int) -> float:
+    commands = set(COMMANDS)
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        for text in TEXTS:
+            Players.parse_command(text, USERNAME, commands)
+    return (time.perf_counter() - started_at) / rounds / len(TEXTS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+    print(f"filters.command: {asyncio.run(with_filters(args.rounds)) * 1e6:.2f}us")
+    print(f"parse_command: {with_parse(args.rounds) * 1e6:.2f}us")
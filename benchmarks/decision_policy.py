@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# decision_policy.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Time every decision policy on a lynch and a night prompt.
+
+Runs without Telegram. Besides the time per decision, it counts the
+decisions by reason and how often an id card holder was voted, which only
+happens when every candidate holds one.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from decision import (  # noqa: E402
+    LYNCH,
+    NIGHT,
+    POLICIES,
+    GroupState,
+    Policy,
+    Prompt,
+    create_policy,
+)
+
+
+def benchmark(
+    policy: Policy, players: int, bots: int, id_cards: int, rounds: int
+) -> tuple[float, dict[str, int]]:
+    """Seconds per decision and count of decisions by reason, id card votes
+    are counted as ``id_card_votes``."""
+    targets = list(range(1, players + 1))
+    prompts = [
+        Prompt(kind, [f"player {x}" for x in targets], targets)
+        for kind in (LYNCH, NIGHT)
+    ]
+    state = GroupState(
+        id_cards=set(targets[:id_cards]), bot_ids=set(targets[-bots:] if bots else ())
+    )
+    counts: dict[str, int] = {"id_card_votes": 0}
+    started_at = time.perf_counter()
+    for x in range(rounds):
+        prompt = prompts[x & 1]
+        decision = policy.decide(prompt, state)
+        counts[decision.reason] = counts.get(decision.reason, 0) + 1
+        if prompt.targets[decision.index] in state.id_cards:
+            counts["id_card_votes"] += 1
+    return (time.perf_counter() - started_at) / rounds, counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=8)
+    parser.add_argument("--bots", type=int, default=3, help="of the players")
+    parser.add_argument("--id-cards", type=int, default=2, help="of the players")
+    parser.add_argument("--rounds", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for name in POLICIES:
+        per_decision, counts = benchmark(
+            create_policy(name, random.Random(args.seed)),
+            args.players,
+            args.bots,
+            args.id_cards,
+            args.rounds,
+        )
+        print(
+            f"{name}: {per_decision * 1e6:.2f}us per decision, "
+            + ", ".join(f"{k}={v}" for k, v in sorted(counts.items()))
+        )
+
+
+if __name__ == "__main__":
+    main()
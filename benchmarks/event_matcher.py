@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# event_matcher.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Throughput of EventMatcher against a substring test per phrase.
+
+Before EventMatcher, handle_normal_resident tested each phrase with ``in``,
+which costs one scan of the message per phrase. Both run over the group
+messages of a transcript recorded with ``[transcript] path``, or over a
+built-in sample of werewolf bot posts. ``--extra`` pads the table with
+phrases that never match, to show how each scales with the table size.
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from player import EventMatcher  # noqa: E402
+from transcript import GROUP, read_transcript  # noqa: E402
+
+EVENTS = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "events.ini"
+)
+# A night and a day of a game, mostly narration, a few events
+SAMPLE = [
+    "夜幕降臨，村民們都回到家中入睡了。",
+    "天亮了，昨晚 小明 被狼人殺害了，他是一名村民。",
+    "小華 出示了來自官方的證明，他是和事佬！",
+    "現在是投票時間，你們有 90 秒決定要處死誰。",
+    "小美 投票處死 小明",
+    "大家決定處死 阿強，他是一名狼人。",
+    "還有 30 秒投票時間",
+    "阿強 回到家中哼起了歌",
+    "Night falls, everyone goes to sleep.",
+    "Game Length: 00:14:52",
+]
+
+
+def load_corpus(path: Optional[str]) -> list[str]:
+    if path is None:
+        return SAMPLE
+    return [
+        text
+        for record in read_transcript(path)
+        if record["kind"] == GROUP
+        and (text := record["message"]["text"] or record["message"]["caption"])
+    ]
+
+
+def with_in(patterns: dict[str, list[str]], corpus: list[str], rounds: int) -> float:
+    phrases = [(x, event) for event, values in patterns.items() for x in values]
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        for text in corpus:
+            {event for phrase, event in phrases if phrase in text}
+    return len(corpus) * rounds / (time.perf_counter() - started_at)
+
+
+def with_matcher(
+    patterns: dict[str, list[str]], corpus: list[str], rounds: int
+) -> float:
+    matcher = EventMatcher(patterns)
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        for text in corpus:
+            matcher.match(text)
+    return len(corpus) * rounds / (time.perf_counter() - started_at)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transcript", help="recorded transcript to use as corpus")
+    parser.add_argument("--events", default=EVENTS, help="event pattern file")
+    parser.add_argument(
+        "--extra",
+        type=int,
+        nargs="*",
+        default=[0, 32, 128],
+        help="phrases added to the table, one run each",
+    )
+    parser.add_argument("--messages", type=int, default=200000, help="per run")
+    args = parser.parse_args()
+    corpus = load_corpus(args.transcript)
+    if not corpus:
+        parser.error(f"No group message in {args.transcript}")
+    patterns = EventMatcher.from_file(args.events).patterns
+    rounds = max(args.messages // len(corpus), 1)
+    for extra in args.extra:
+        padded = {**patterns, "padding": [f"填充短語 {x}" for x in range(extra)]}
+        phrases = sum(len(x) for x in padded.values())
+        print(
+            f"{phrases} phrases: "
+            f"in {with_in(padded, corpus, rounds) / 1e6:.2f}M msg/s, "
+            f"EventMatcher {with_matcher(padded, corpus, rounds) / 1e6:.2f}M msg/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
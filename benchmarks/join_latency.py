@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# join_latency.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Time handle_join_game against each state storage backend.
+
+Every game runs the full join path on fake clients without network latency,
+so the difference between backends is their storage calls. Redis runs on
+fakeredis, or on a real server with ``--redis-url``.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulator import FakeWerewolfBot, build_players, percentile  # noqa: E402
+from storage import (  # noqa: E402
+    MemoryBackend,
+    RedisBackend,
+    SQLiteBackend,
+    StateBackend,
+)
+
+CHAT_ID = -1000
+
+
+async def measure(backend: StateBackend, games: int) -> dict[str, float]:
+    bot = FakeWerewolfBot()
+    players = await build_players(
+        bot,
+        [CHAT_ID],
+        {"werewolf0": 100, "werewolf1": 101},
+        rate_limit=(games * 4, games),
+        state_store=backend,
+    )
+    listener = players.client_group[0]
+    round_trips = backend.round_trips
+    latency: list[float] = []
+    for _ in range(games):
+        msg = bot.announcement(listener, bot.announce(CHAT_ID, []))
+        started_at = time.perf_counter()
+        await players.handle_listener_message(listener, msg)
+        latency.append(time.perf_counter() - started_at)
+        # Next game, every account is free again
+        bot.games.clear()
+        players.worker_scheduler.release(CHAT_ID)
+    await backend.flush()
+    result = {
+        "p50_ms": percentile(latency, 0.5) * 1000,
+        "p99_ms": percentile(latency, 0.99) * 1000,
+        "writes_per_game": (backend.round_trips - round_trips) / games,
+    }
+    await players.stop()
+    return result
+
+
+async def create(name: str, directory: str, redis_url: Optional[str]) -> StateBackend:
+    if name == "redis":
+        if redis_url:
+            return await RedisBackend.from_url(redis_url, "join_latency")
+        import fakeredis
+
+        return RedisBackend(fakeredis.FakeAsyncRedis(), "join_latency")
+    if name == "sqlite":
+        return SQLiteBackend(os.path.join(directory, "werewolf.db"), "join_latency")
+    return MemoryBackend("join_latency", os.path.join(directory, "werewolf.json"))
+
+
+async def main(games: int, redis_url: Optional[str]) -> None:
+    for name in ("redis", "sqlite", "memory"):
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                backend = await create(name, directory, redis_url)
+            except ModuleNotFoundError:
+                print(f"{name}: skipped, install fakeredis or pass --redis-url")
+                continue
+            result = await measure(backend, games)
+        print(
+            f"{name}: "
+            + ", ".join(f"{key}={value:.3f}" for key, value in result.items())
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=500)
+    parser.add_argument("--redis-url", help="real redis server instead of fakeredis")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("Werewolf_bot").setLevel(logging.WARNING)
+    asyncio.run(main(args.games, args.redis_url))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# logging_overhead.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Event loop time spent logging a vote burst, before and after logs.setup.
+
+Every account logs each werewolf bot message it gets, and the group messages
+are logged at debug level. Before, records were formatted and written on the
+event loop by a stream handler, and ``logger.debug(repr(msg))`` built the repr
+even with debug off (the default here). After, the message is formatted lazily and records go
+through the queue of ``logs.setup``. Output goes to a file in a temporary
+directory, or to the terminal with ``--console``.
+"""
+
+import argparse
+import asyncio
+import logging
+import logging.handlers
+import os
+import sys
+import tempfile
+import time
+from configparser import ConfigParser
+from typing import Callable, Optional, TextIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyrogram.enums import ChatType, MessageEntityType  # noqa: E402
+from pyrogram.types import Chat, Message, MessageEntity, User  # noqa: E402
+
+import logs  # noqa: E402
+from player import Players  # noqa: E402
+
+logger = logging.getLogger(logs.ROOT_LOGGER).getChild("game")
+
+
+def group_message(x: int) -> Message:
+    return Message(
+        id=x,
+        chat=Chat(id=-1000, type=ChatType.SUPERGROUP, title="Werewolf"),
+        from_user=User(id=Players.WEREWOLF_BOT_ID, first_name="Werewolf", is_bot=True),
+        text=f"玩家{x} 出示了來自官方的證明",
+        entities=[
+            MessageEntity(
+                type=MessageEntityType.TEXT_MENTION,
+                offset=0,
+                length=3,
+                user=User(id=1000 + x, first_name=f"玩家{x}"),
+            )
+        ],
+    )
+
+
+def log_before(name: str, msg: Message) -> None:
+    logger.debug(repr(msg))
+    logger.info("%s: %s", name, msg.text)
+
+
+def log_after(name: str, msg: Message) -> None:
+    logger.debug("%r", msg)
+    logger.info("%s: %s", name, msg.text)
+
+
+def setup_before(stream: TextIO) -> None:
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(logs.COLORED_FORMAT))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(logging.DEBUG)
+
+
+def setup_after(stream: TextIO) -> logging.handlers.QueueListener:
+    # The console handler of logs.setup writes to sys.stderr
+    stderr, sys.stderr = sys.stderr, stream
+    try:
+        return logs.setup(ConfigParser())
+    finally:
+        sys.stderr = stderr
+
+
+async def burst(
+    log: Callable[[str, Message], None], accounts: int, messages: int
+) -> dict[str, float]:
+    names = [f"werewolf{x}" for x in range(accounts)]
+    corpus = [group_message(x) for x in range(messages)]
+    lag = 0.0
+    running = True
+
+    async def ticker() -> None:
+        nonlocal lag
+        while running:
+            started_at = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - started_at - 0.001)
+
+    async def account(name: str) -> float:
+        spent = 0.0
+        for msg in corpus:
+            started_at = time.perf_counter()
+            log(name, msg)
+            spent += time.perf_counter() - started_at
+            await asyncio.sleep(0)
+        return spent
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    spent = sum(await asyncio.gather(*(account(x) for x in names)))
+    running = False
+    await task
+    return {
+        "loop_ms": spent * 1000,
+        "per_message_us": spent / (accounts * messages) * 1e6,
+        "max_lag_ms": lag * 1000,
+    }
+
+
+def run(name: str, accounts: int, messages: int, console: bool, directory: str) -> None:
+    stream = sys.stderr if console else open(os.path.join(directory, name), "w")
+    listener: Optional[logging.handlers.QueueListener] = None
+    if name == "before":
+        setup_before(stream)
+        log = log_before
+    else:
+        listener = setup_after(stream)
+        log = log_after
+    result = asyncio.run(burst(log, accounts, messages))
+    started_at = time.perf_counter()
+    if listener is not None:
+        listener.stop()
+    result["drain_ms"] = (time.perf_counter() - started_at) * 1000
+    if not console:
+        stream.close()
+    print(
+        f"{name}: " + ", ".join(f"{key}={value:.2f}" for key, value in result.items()),
+        file=sys.__stdout__,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=200, help="per account")
+    parser.add_argument(
+        "--console", action="store_true", help="write to the terminal, not a file"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="log at debug level, as with --debug"
+    )
+    args = parser.parse_args()
+    logger.setLevel(logging.DEBUG if args.debug else logging.INFO)
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ("before", "after"):
+            run(name, args.accounts, args.messages, args.console, directory)
+
+
+if __name__ == "__main__":
+    main()
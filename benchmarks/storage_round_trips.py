@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# storage_round_trips.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Count the redis round trips a game costs with and without batching.
+
+Each game makes the state changes Players makes: the join clears the id
+cards and maps every account's game id to the group, a few id cards are
+revealed, the owner sets a target, and the end removes the game ids. The
+changes arrive in bursts, as they do in a game. ``per change`` writes each
+change on its own, ``batched`` leaves them to the background writer.
+The join key is read and written right away in both, so those two round
+trips per game are not counted.
+Redis runs on fakeredis, or on a real server with ``--redis-url``.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import RedisBackend  # noqa: E402
+
+
+async def play(
+    backend: RedisBackend, chat_id: int, accounts: int, gap: float, batched: bool
+) -> int:
+    """Play one game in ``chat_id``, returns the number of changes made."""
+    changes = 0
+    game_ids = [f"{chat_id}_{x}" for x in range(accounts)]
+
+    async def burst(*calls) -> None:
+        nonlocal changes
+        for call in calls:
+            call()
+            changes += 1
+            if not batched:
+                await backend.flush()
+        await asyncio.sleep(gap)
+
+    await backend.get_join_key(chat_id)
+    await backend.set_join_key(chat_id, f"{chat_id}_join")
+    await burst(
+        lambda: backend.clear_id_cards(chat_id),
+        *(
+            lambda game_id=game_id: backend.set_identification(game_id, chat_id)
+            for game_id in game_ids
+        ),
+    )
+    await burst(lambda: backend.set_target(chat_id, "player 3", True))
+    await burst(
+        lambda: backend.add_id_card(chat_id, 1001),
+        lambda: backend.add_id_card(chat_id, 1002),
+    )
+    await burst(lambda: backend.add_id_card(chat_id, 1003))
+    await burst(
+        lambda: backend.clear_id_cards(chat_id),
+        *(
+            lambda game_id=game_id: backend.remove_identification(game_id)
+            for game_id in game_ids
+        ),
+    )
+    return changes
+
+
+async def measure(
+    backend: RedisBackend,
+    groups: int,
+    accounts: int,
+    games: int,
+    gap: float,
+    batched: bool,
+) -> dict[str, float]:
+    chat_ids = [-1000 - x for x in range(groups)]
+    if batched:
+        backend.start()
+    changes = 0
+    for _ in range(games):
+        # A game in every group at the same time
+        changes += sum(
+            await asyncio.gather(
+                *(play(backend, x, accounts, gap, batched) for x in chat_ids)
+            )
+        )
+    await backend.stop()
+    played = games * groups
+    return {
+        "changes_per_game": changes / played,
+        "round_trips_per_game": backend.round_trips / played,
+    }
+
+
+async def create(redis_url: Optional[str], prefix: str) -> RedisBackend:
+    if redis_url:
+        return await RedisBackend.from_url(redis_url, prefix)
+    import fakeredis
+
+    return RedisBackend(fakeredis.FakeAsyncRedis(), prefix)
+
+
+async def main(
+    groups: int,
+    accounts: int,
+    games: int,
+    gap: float,
+    flush_interval: float,
+    redis_url: Optional[str],
+) -> None:
+    for name, batched in (("per change", False), ("batched", True)):
+        backend = await create(redis_url, "storage_round_trips")
+        backend.flush_interval = flush_interval
+        result = await measure(backend, groups, accounts, games, gap, batched)
+        print(
+            f"{name}: "
+            + ", ".join(f"{key}={value:.2f}" for key, value in result.items())
+        )
+    backend = await create(redis_url, "storage_round_trips")
+    await backend.load([-1000 - x for x in range(groups)])
+    print(f"load of {groups} groups: round_trips={backend.round_trips}")
+    await backend.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--groups", type=int, default=4)
+    parser.add_argument("--accounts", type=int, default=5, help="per game")
+    parser.add_argument("--games", type=int, default=20, help="per group")
+    parser.add_argument(
+        "--gap", type=float, default=0.02, help="seconds between bursts of a game"
+    )
+    parser.add_argument("--flush-interval", type=float, default=0.005)
+    parser.add_argument("--redis-url", help="real redis server instead of fakeredis")
+    args = parser.parse_args()
+    asyncio.run(
+        main(
+            args.groups,
+            args.accounts,
+            args.games,
+            args.gap,
+            args.flush_interval,
+            args.redis_url,
+        )
+    )
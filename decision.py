@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# decision.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Which button of a werewolf bot prompt to click.
+
+A policy gets the prompt and the targeting state of its group and picks a
+button in one pass, no Telegram object is involved, so policies can be run
+and timed on their own.
+"""
+
+from __future__ import annotations
+import random
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Prompt types, as classified by ClickScheduler
+LYNCH = "lynch"
+NIGHT = "night"
+SINGLE = "single"
+
+# Reasons of a decision, also the label of the decision metric
+ONLY = "only"
+TARGET = "target"
+HUMAN = "human"
+RANDOM = "random"
+
+
+@dataclass
+class Prompt:
+    kind: str
+    # Lower cased button texts
+    labels: list[str]
+    # User id voted by each button, None for buttons such as skip
+    targets: list[Optional[int]]
+
+    @classmethod
+    def from_buttons(
+        cls, kind: str, texts: list[str], targets: list[Optional[int]]
+    ) -> Prompt:
+        return cls(kind, [x.lower() for x in texts], targets)
+
+
+@dataclass
+class GroupState:
+    """Targeting state of one group, the sets are only read."""
+
+    # Lower cased part of the name to vote for, empty for none
+    target: str = ""
+    force_human: bool = False
+    id_cards: set[int] = field(default_factory=set)
+    bot_ids: set[int] = field(default_factory=set)
+
+    def __post_init__(self) -> None:
+        self.target = self.target.lower()
+
+
+@dataclass(frozen=True)
+class Decision:
+    index: int
+    reason: str
+
+
+class Policy:
+    name = "base"
+
+    def __init__(self, rng: Optional[random.Random] = None):
+        # Pass a seeded random.Random for repeatable decisions
+        self.rng = rng or random.Random()
+
+    def decide(self, prompt: Prompt, state: GroupState) -> Decision:
+        raise NotImplementedError
+
+    @staticmethod
+    def find_target(prompt: Prompt, target: str) -> Optional[int]:
+        for index, label in enumerate(prompt.labels):
+            if target in label:
+                return index
+        return None
+
+    def pick(self, prompt: Prompt, state: GroupState, human_only: bool) -> Decision:
+        """A random button, never an id card holder unless every candidate
+        is one, and with ``human_only`` never one of our bots if avoidable."""
+        candidates = range(len(prompt.targets))
+        if human_only:
+            humans = [
+                x
+                for x in candidates
+                if prompt.targets[x] is not None
+                and prompt.targets[x] not in state.bot_ids
+            ]
+            if humans:
+                candidates = humans
+        safe = [x for x in candidates if prompt.targets[x] not in state.id_cards]
+        return Decision(
+            self.rng.choice(safe or candidates), HUMAN if human_only else RANDOM
+        )
+
+
+class DefaultPolicy(Policy):
+    """Vote for the target when it is on the prompt, else at random.
+
+    Lynch votes go to humans when forced, and otherwise now and then, more
+    often in small games, so our bots don't always survive together.
+    """
+
+    name = "default"
+    HUMAN_CHANCE = 1 / 10
+    SMALL_GAME = 4
+    SMALL_GAME_HUMAN_CHANCE = 1 / 7
+
+    def decide(self, prompt: Prompt, state: GroupState) -> Decision:
+        if len(prompt.labels) == 1:
+            return Decision(0, ONLY)
+        if (
+            state.target
+            and (index := self.find_target(prompt, state.target)) is not None
+        ):
+            return Decision(index, TARGET)
+        human_only = prompt.kind == LYNCH and (
+            state.force_human
+            or self.rng.random() < self.HUMAN_CHANCE
+            or (
+                len(prompt.labels) < self.SMALL_GAME
+                and self.rng.random() < self.SMALL_GAME_HUMAN_CHANCE
+            )
+        )
+        return self.pick(prompt, state, human_only)
+
+
+class HumanPolicy(Policy):
+    """Vote for the target when it is on the prompt, else for a human on
+    every prompt, night actions included."""
+
+    name = "human"
+
+    def decide(self, prompt: Prompt, state: GroupState) -> Decision:
+        if len(prompt.labels) == 1:
+            return Decision(0, ONLY)
+        if (
+            state.target
+            and (index := self.find_target(prompt, state.target)) is not None
+        ):
+            return Decision(index, TARGET)
+        return self.pick(prompt, state, True)
+
+
+POLICIES: dict[str, type[Policy]] = {
+    DefaultPolicy.name: DefaultPolicy,
+    HumanPolicy.name: HumanPolicy,
+}
+
+
+def create_policy(name: str, rng: Optional[random.Random] = None) -> Policy:
+    if (policy := POLICIES.get(name)) is None:
+        raise ValueError(f"Unknown decision policy: {name}")
+    return policy(rng)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# diagnostics.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Live diagnosis of a running bot: CPU profile, memory growth, task dump.
+
+Every capture writes its full report to a file and returns a short summary
+fit for a Telegram message.
+"""
+
+from __future__ import annotations
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from collections import Counter, deque
+from typing import Optional
+
+logger = logging.getLogger("Werewolf_bot").getChild("diagnostics")
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines: list[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.lines.append(record.getMessage())
+
+
+class Diagnostics:
+    """Captures run on demand, only the loop lag monitor runs all the time.
+
+    The monitor wakes up every ``interval`` seconds and counts how late it
+    was, a lateness above ``slow_callback`` means a callback held the loop.
+    """
+
+    # Memory tracing slows every allocation, it stops by itself after this
+    # many diffs in case nobody sends /mem stop
+    MAX_MEMORY_DIFFS = 10
+
+    def __init__(
+        self,
+        directory: str = "diagnostics",
+        slow_callback: float = 0.1,
+        interval: float = 0.5,
+    ):
+        self.directory = directory
+        self.slow_callback = slow_callback
+        self.interval = interval
+        self.max_lag: float = 0
+        self.slow_count = 0
+        # (wall time, lag) of the latest stalls
+        self.stalls: deque[tuple[float, float]] = deque(maxlen=20)
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._memory_diffs = 0
+        self._snapshotting = False
+        self._profiling = False
+        self.future: Optional[asyncio.Task] = None
+
+    def _path(self, kind: str, ext: str = "txt") -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(
+            self.directory, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.{ext}"
+        )
+
+    async def _monitor(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - expected
+            if lag > self.slow_callback:
+                self.slow_count += 1
+                self.max_lag = max(self.max_lag, lag)
+                self.stalls.append((time.time(), lag))
+                logger.warning("Event loop stalled for %.3fs", lag)
+
+    def start(self) -> None:
+        if self.future is None:
+            self.future = asyncio.create_task(self._monitor())
+
+    def stop(self) -> None:
+        if self.future is not None:
+            self.future.cancel()
+            self.future = None
+        if tracemalloc.is_tracing():
+            self.stop_memory()
+
+    async def profile(self, seconds: float, top: int = 8) -> tuple[str, str]:
+        """Run cProfile on the event loop thread for ``seconds``."""
+        if self._profiling:
+            raise RuntimeError("A profile is already running")
+        self._profiling = True
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+            self._profiling = False
+        path = self._path("profile", "prof")
+        profiler.dump_stats(path)
+        report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(50)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(50)
+        with open(f"{path}.txt", "w") as fout:
+            fout.write(report.getvalue())
+        lines = [f"{seconds:g}s profile, {stats.total_calls} calls"]
+        for (filename, line, func), (_cc, _nc, tottime, cumtime, _callers) in sorted(
+            stats.stats.items(), key=lambda x: x[1][2], reverse=True
+        )[:top]:
+            lines.append(
+                f"{tottime:.3f}s/{cumtime:.3f}s "
+                f"{os.path.basename(filename)}:{line}({func})"
+            )
+        return path, "\n".join(lines)
+
+    async def memory(self, top: int = 8) -> tuple[str, str]:
+        """Diff a tracemalloc snapshot against the previous one.
+
+        Tracing starts with the first call, which only takes the baseline.
+        Snapshots are taken and compared in a worker thread.
+        """
+        if self._snapshotting:
+            raise RuntimeError("A memory snapshot is already running")
+        self._snapshotting = True
+        loop = asyncio.get_running_loop()
+        try:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._memory_diffs = 0
+                self._snapshot = await loop.run_in_executor(
+                    None, tracemalloc.take_snapshot
+                )
+                return "", (
+                    "Started tracing memory, run again later to see the growth "
+                    "and /mem stop when done"
+                )
+            path, summary = await loop.run_in_executor(None, self._memory_diff, top)
+        finally:
+            self._snapshotting = False
+        self._memory_diffs += 1
+        if self._memory_diffs >= self.MAX_MEMORY_DIFFS:
+            summary += f"\n{self.stop_memory()} after {self._memory_diffs} diffs"
+        return path, summary
+
+    def _memory_diff(self, top: int) -> tuple[str, str]:
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+        diff = snapshot.compare_to(self._snapshot, "lineno")
+        self._snapshot = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        path = self._path("memory")
+        with open(path, "w") as fout:
+            fout.write(f"current={current} peak={peak}\n")
+            fout.writelines(f"{x}\n" for x in diff[:100])
+        lines = [f"Traced {current / 2**20:.1f} MiB, peak {peak / 2**20:.1f} MiB"]
+        for stat in diff[:top]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size_diff / 1024:+.1f} KiB "
+                f"{os.path.basename(frame.filename)}:{frame.lineno}"
+            )
+        return path, "\n".join(lines)
+
+    def stop_memory(self) -> str:
+        if not tracemalloc.is_tracing():
+            return "Memory tracing is not running"
+        tracemalloc.stop()
+        self._snapshot = None
+        return "Stopped tracing memory"
+
+    async def tasks(self, debug_seconds: float = 0, top: int = 8) -> tuple[str, str]:
+        """Dump every asyncio task, and with ``debug_seconds`` run the loop in
+        debug mode that long to name callbacks slower than ``slow_callback``.
+        """
+        slow_callbacks: list[str] = []
+        if debug_seconds:
+            loop = asyncio.get_running_loop()
+            handler = _ListHandler()
+            asyncio_logger = logging.getLogger("asyncio")
+            asyncio_logger.addHandler(handler)
+            previous = loop.slow_callback_duration
+            loop.slow_callback_duration = self.slow_callback
+            loop.set_debug(True)
+            try:
+                await asyncio.sleep(debug_seconds)
+            finally:
+                loop.set_debug(False)
+                loop.slow_callback_duration = previous
+                asyncio_logger.removeHandler(handler)
+            slow_callbacks = [x for x in handler.lines if "took" in x]
+        current = asyncio.current_task()
+        tasks = [x for x in asyncio.all_tasks() if x is not current]
+        by_coroutine = Counter(x.get_coro().__qualname__ for x in tasks)
+        path = self._path("tasks")
+        with open(path, "w") as fout:
+            fout.write(
+                f"max_lag={self.max_lag:.3f} slow_count={self.slow_count}\n"
+                + "".join(
+                    f"stall {time.strftime('%H:%M:%S', time.localtime(at))} "
+                    f"{lag:.3f}s\n"
+                    for at, lag in self.stalls
+                )
+            )
+            fout.writelines(f"{x}\n" for x in slow_callbacks)
+            for task in tasks:
+                fout.write(f"\n{task!r}\n")
+                task.print_stack(limit=10, file=fout)
+        lines = [
+            f"{len(tasks)} tasks, loop stalled {self.slow_count} times "
+            f"(max {self.max_lag:.3f}s)"
+        ]
+        if debug_seconds:
+            lines.append(
+                f"{len(slow_callbacks)} callbacks over {self.slow_callback:g}s "
+                f"in {debug_seconds:g}s"
+            )
+        lines.extend(f"{count} {name}" for name, count in by_coroutine.most_common(top))
+        return path, "\n".join(lines)
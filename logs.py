@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# logs.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Queue based logging, so the event loop never waits for a terminal or disk.
+
+Records are put on a queue unformatted and a background thread formats and
+writes them. Subsystems are the children of the ``Werewolf_bot`` logger
+(``game``, ``storage``, ...) and can be sampled or rate limited on their own.
+"""
+
+from __future__ import annotations
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from configparser import ConfigParser
+from typing import Optional
+
+ROOT_LOGGER = "Werewolf_bot"
+FORMAT = "%(asctime)s - %(levelname)s - %(funcName)s - %(lineno)d - %(message)s"
+COLORED_FORMAT = (
+    "%(asctime)s,%(msecs)03d - %(levelname)s - %(funcName)s - %(lineno)d - "
+    "%(message)s"
+)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records as they are, ``QueueHandler`` would format the message
+    on the calling thread, which is exactly the work we want off the loop."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class SubsystemFilter(logging.Filter):
+    """Base of filters configured per subsystem.
+
+    ``limits`` maps a logger name to its setting, a record uses the setting
+    of its closest configured ancestor. Only records below ``WARNING`` are
+    ever dropped.
+    """
+
+    def __init__(self, limits: dict[str, float]):
+        super().__init__()
+        self.limits = limits
+        self._resolved: dict[str, Optional[str]] = {}
+
+    def resolve(self, name: str) -> Optional[str]:
+        if (resolved := self._resolved.get(name, "")) != "":
+            return resolved
+        resolved, parts = None, name.split(".")
+        while parts:
+            if (candidate := ".".join(parts)) in self.limits:
+                resolved = candidate
+                break
+            parts.pop()
+        self._resolved[name] = resolved
+        return resolved
+
+
+class SamplingFilter(SubsystemFilter):
+    """Keep the configured fraction of a subsystem's records."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if (name := self.resolve(record.name)) is None:
+            return True
+        return random.random() < self.limits[name]
+
+
+class RateLimitFilter(SubsystemFilter):
+    """Keep at most the configured number of a subsystem's records per second,
+    the count of dropped records is logged with the next record let through."""
+
+    def __init__(self, limits: dict[str, float]):
+        super().__init__(limits)
+        # subsystem -> [tokens, updated_at, dropped]
+        self.buckets: dict[str, list[float]] = {
+            name: [rate, time.monotonic(), 0] for name, rate in limits.items()
+        }
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if (name := self.resolve(record.name)) is None:
+            return True
+        bucket, rate = self.buckets[name], self.limits[name]
+        now = time.monotonic()
+        bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.dropped = int(bucket[2])
+            bucket[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        obj = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if dropped := getattr(record, "dropped", 0):
+            obj["dropped"] = dropped
+        if record.exc_info:
+            obj["exception"] = self.formatException(record.exc_info)
+        return json.dumps(obj, ensure_ascii=False)
+
+
+class DroppedFormatter(logging.Formatter):
+    """Wrap ``formatter`` and mention records dropped by the rate limit."""
+
+    def __init__(self, formatter: logging.Formatter):
+        super().__init__()
+        self.formatter = formatter
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = self.formatter.format(record)
+        if dropped := getattr(record, "dropped", 0):
+            text += f" ({dropped} similar records dropped)"
+        return text
+
+
+def _console_handler() -> logging.Handler:
+    handler = logging.StreamHandler()
+    try:
+        import coloredlogs
+
+        formatter = coloredlogs.ColoredFormatter(COLORED_FORMAT)
+    except ModuleNotFoundError:
+        formatter = logging.Formatter(FORMAT)
+    handler.setFormatter(DroppedFormatter(formatter))
+    return handler
+
+
+def _subsystem_limits(config: ConfigParser, section: str) -> dict[str, float]:
+    if not config.has_section(section):
+        return {}
+    return {
+        f"{ROOT_LOGGER}.{name}": float(value)
+        for name, value in config.items(section)
+        if value.strip()
+    }
+
+
+def setup(
+    config: ConfigParser, shard_index: Optional[int] = None
+) -> logging.handlers.QueueListener:
+    """Route every log record through a queue to the console and, when
+    ``[logging] file`` is set, a rotating JSON lines file.
+
+    The returned listener owns the writer thread, stop it before exiting so
+    queued records are written.
+    """
+    handlers = [_console_handler()]
+    if path := config.get("logging", "file", fallback=""):
+        if shard_index is not None:
+            root, ext = os.path.splitext(path)
+            path = f"{root}.{shard_index}{ext}"
+        file_handler = logging.handlers.RotatingFileHandler(
+            path,
+            maxBytes=config.getint("logging", "max_bytes", fallback=10 * 1024 * 1024),
+            backupCount=config.getint("logging", "backup_count", fallback=5),
+            encoding="utf-8",
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    if limits := _subsystem_limits(config, "logging.sample"):
+        queue_handler.addFilter(SamplingFilter(limits))
+    if limits := _subsystem_limits(config, "logging.ratelimit"):
+        queue_handler.addFilter(RateLimitFilter(limits))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(logging.DEBUG)
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    return listener
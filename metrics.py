@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# metrics.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""In-process metrics served in the Prometheus text format.
+
+Instruments only update a few numbers in a dict, nothing is formatted until
+the endpoint is scraped, so they stay on in production. Label values are
+passed positionally in the order the instrument declares them.
+"""
+
+from __future__ import annotations
+import asyncio
+import bisect
+import logging
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Optional
+
+logger = logging.getLogger("Werewolf_bot").getChild("metrics")
+
+# Seconds, from a fast lock or redis call up to a slow join
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '{}="{}"'.format(
+                name,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for name, value in zip(names, values)
+        )
+        + "}"
+    )
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join(
+            [
+                f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.kind}",
+                *self.samples(),
+            ]
+        )
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {value}"
+            for key, value in self.values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *label_values: str, value: float) -> None:
+        self.values[label_values] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # label values -> [count per bucket (the last one is +Inf), sum]
+        self.values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        if (entry := self.values.get(label_values)) is None:
+            entry = self.values[label_values] = ([0] * (len(self.buckets) + 1), [0])
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    @asynccontextmanager
+    async def time(self, *label_values: str) -> AsyncIterator[None]:
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started_at, *label_values)
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _format_labels((*self.labels, "le"), (*key, str(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total[0]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(x.render() for x in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+PROMPT_TO_CLICK: Histogram = REGISTRY.register(
+    Histogram(
+        "werewolf_prompt_to_click_seconds",
+        "Time from a werewolf bot prompt arriving to its button being clicked",
+        ("prompt_type",),
+    )
+)
+JOIN_LATENCY: Histogram = REGISTRY.register(
+    Histogram(
+        "werewolf_join_seconds",
+        "Time from the first join command to the werewolf bot confirming it",
+        ("account",),
+    )
+)
+STORAGE_LATENCY: Histogram = REGISTRY.register(
+    Histogram(
+        "werewolf_storage_seconds",
+        "Latency of state storage calls",
+        ("backend", "operation"),
+    )
+)
+FLOOD_WAITS: Counter = REGISTRY.register(
+    Counter("werewolf_flood_waits_total", "FloodWait errors received", ("account",))
+)
+ACTIVE_GAMES: Gauge = REGISTRY.register(
+    Gauge("werewolf_active_games", "Games currently joined in a group", ("group",))
+)
+ACCOUNT_JOINS: Counter = REGISTRY.register(
+    Counter(
+        "werewolf_account_games_total",
+        "Games each account was picked for",
+        ("account",),
+    )
+)
+DECISIONS: Counter = REGISTRY.register(
+    Counter(
+        "werewolf_decisions_total",
+        "Prompt buttons chosen, by decision policy and reason",
+        ("policy", "reason"),
+    )
+)
+STARTUP: Gauge = REGISTRY.register(
+    Gauge(
+        "werewolf_startup_seconds",
+        "Seconds from start until listening, every worker started and the first join",
+        ("stage",),
+    )
+)
+
+
+class MetricsServer:
+    """Serve ``registry`` to ``GET /metrics`` over plain HTTP."""
+
+    def __init__(
+        self, host: str = "127.0.0.1", port: int = 9464, registry: Registry = REGISTRY
+    ):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            method, path, *_ = request.split(b" ", 2)
+            if method != b"GET":
+                status, body = "405 Method Not Allowed", ""
+            elif path.split(b"?", 1)[0] != b"/metrics":
+                status, body = "404 Not Found", ""
+            else:
+                status, body = "200 OK", self.registry.render()
+            payload = body.encode()
+            writer.write(
+                (
+                    f"HTTP/1.1 {status}\r\n"
+                    "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode()
+                + payload
+            )
+            await writer.drain()
+        except (
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            asyncio.TimeoutError,
+            ValueError,
+        ):
+            pass
+        except ConnectionError:
+            logger.debug("Metrics client disconnected")
+        finally:
+            writer.close()
+
+    async def start(self) -> None:
+        if self.server is None:
+            self.server = await asyncio.start_server(self._handle, self.host, self.port)
+            logger.info("Serving metrics on %s:%d", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
@@ -21,52 +21,391 @@
 from __future__ import annotations
 import ast
 import asyncio
-import concurrent.futures
+import functools
+import itertools
+import json
 import logging
+import os
 import random
+import re
+import signal
 import sys
+import time
 import warnings
+from collections import Counter, OrderedDict, deque
+import configparser
 from configparser import ConfigParser
 from dataclasses import dataclass
-from typing import Coroutine, Optional
+from typing import Any, Awaitable, Callable, Collection, Coroutine, Optional, Union
 
 from redis import asyncio as aioredis
 import pyrogram
-from pyrogram import Client, ContinuePropagation, filters
+from pyrogram import Client, ContinuePropagation, StopPropagation, filters
+from pyrogram.enums import MessageEntityType
 from pyrogram.handlers import MessageHandler
-from pyrogram.types import Message, ReplyKeyboardRemove
-from pyrogram.errors import MessageIdInvalid
+from pyrogram.types import InlineKeyboardMarkup, Message, ReplyKeyboardRemove
+from pyrogram.errors import FloodWait, MessageIdInvalid
+
+import decision
+import diagnostics
+import logs
+import metrics
+import transcript
+from storage import GameState, RedisBackend, StateBackend, create_backend
+
+COMMAND_RE = re.compile(r"([\"'])(.*?)(?<!\\)\1|(\S+)")
 
 logger = logging.getLogger("Werewolf_bot")
 logger.setLevel(logging.INFO)
 logger_detail = logger.getChild("detail")
+# Werewolf bot private messages and clicks of every account
+logger_game = logger.getChild("game")
 logger.setLevel(logging.INFO)
 
 
-class JoinGameTracker:
-    def __init__(self, client: Client, key: str):
+class RateLimiter:
+    """Token bucket shared by every outgoing call of one account.
+
+    ``FloodWait`` raised by a call blocks the bucket for the time the server
+    asks for and the call is scheduled again instead of failing.
+    """
+
+    LOAD_HALF_LIFE = 60
+
+    def __init__(
+        self, name: str, burst: int = 5, refill_rate: float = 1.0, retries: int = 3
+    ):
+        self.name = name
+        self.burst = burst
+        self.refill_rate = refill_rate
+        self.retries = retries
+        self.tokens: float = burst
+        self.updated_at = time.monotonic()
+        self.flood_until: float = 0
+        self.queue_depth = 0
+        self.calls = 0
+        self.flood_waits = 0
+        self.total_wait: float = 0
+        self.max_wait: float = 0
+        # Calls made recently, decaying with LOAD_HALF_LIFE
+        self.load: float = 0
+        self.load_at = time.monotonic()
+        # Keeps waiters in FIFO order
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated_at) * self.refill_rate
+        )
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        started_at = time.monotonic()
+        self.queue_depth += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self.flood_until:
+                        await asyncio.sleep(self.flood_until - now)
+                        continue
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    await asyncio.sleep((1 - self.tokens) / self.refill_rate)
+        finally:
+            self.queue_depth -= 1
+        now = time.monotonic()
+        waited = now - started_at
+        self.load = self.recent_load(now) + 1
+        self.load_at = now
+        self.calls += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    async def call(
+        self, func: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any
+    ) -> Any:
+        for retries in range(self.retries + 1):
+            await self.acquire()
+            try:
+                return await func(*args, **kwargs)
+            except FloodWait as e:
+                if retries == self.retries:
+                    raise
+                self.flood_waits += 1
+                metrics.FLOOD_WAITS.inc(self.name)
+                self.flood_until = max(self.flood_until, time.monotonic() + e.value)
+                logger.warning(
+                    "%s: Got FloodWait, retry after %ds (retries: %d)",
+                    self.name,
+                    e.value,
+                    retries + 1,
+                )
+
+    def recent_load(self, now: float) -> float:
+        return self.load * 0.5 ** ((now - self.load_at) / self.LOAD_HALF_LIFE)
+
+    def flooded(self, now: float) -> bool:
+        return now < self.flood_until
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "queue_depth": self.queue_depth,
+            "tokens": round(self.tokens, 2),
+            "calls": self.calls,
+            "flood_waits": self.flood_waits,
+            "avg_wait": round(self.total_wait / self.calls, 3) if self.calls else 0,
+            "max_wait": round(self.max_wait, 3),
+            "flood_remain": round(max(self.flood_until - time.monotonic(), 0), 1),
+        }
+
+
+class ListenerElection:
+    """Decide which listening account handles each group update.
+
+    The leader handles an update as soon as it arrives. Hot standbys wait up
+    to ``failover_delay`` seconds for the leader to claim the same
+    (chat_id, message_id); if it doesn't, the first standby claims the
+    update and becomes the leader. Claims are checked and set without
+    yielding to the event loop, so an update is never handled twice.
+    """
+
+    def __init__(self, failover_delay: float = 2, capacity: int = 4096):
+        self.leader: Optional[str] = None
+        self.failover_delay = failover_delay
+        self.capacity = capacity
+        self._claimed: OrderedDict[tuple[int, int], str] = OrderedDict()
+
+    def _try_claim(self, client_name: str, key: tuple[int, int]) -> bool:
+        if key in self._claimed:
+            return False
+        self._claimed[key] = client_name
+        if len(self._claimed) > self.capacity:
+            self._claimed.popitem(last=False)
+        return True
+
+    async def claim(self, client_name: str, chat_id: int, message_id: int) -> bool:
+        key = (chat_id, message_id)
+        if self.leader is None:
+            self.leader = client_name
+        if client_name == self.leader:
+            return self._try_claim(client_name, key)
+        deadline = time.monotonic() + self.failover_delay
+        while time.monotonic() < deadline:
+            if key in self._claimed:
+                return False
+            await asyncio.sleep(0.1)
+        if not self._try_claim(client_name, key):
+            return False
+        logger.warning(
+            "Listener %s missed update %s, %s took over",
+            self.leader,
+            key,
+            client_name,
+        )
+        self.leader = client_name
+        return True
+
+
+class ShardCoordinator:
+    """Share commands and game state between shards through Redis pub/sub.
+
+    Only shard 0 listens to the monitored groups. It publishes joins,
+    targets, id cards and resends, every other shard applies them to its own
+    accounts. Events published by a shard are ignored by that same shard.
+    """
+
+    # Seconds between reconnects to redis, doubled up to the maximum
+    RECONNECT_DELAY = 0.5
+    MAX_RECONNECT_DELAY = 30
+
+    def __init__(self, players: Players, channel: str):
+        self.players = players
+        self.channel = channel
+        self.future: Optional[asyncio.Task] = None
+        self.reconnects = 0
+
+    async def publish(self, event_type: str, **kwargs: Any) -> None:
+        await self.players.redis.publish(
+            self.channel,
+            json.dumps(
+                {"type": event_type, "shard": self.players.shard_index, **kwargs}
+            ),
+        )
+
+    @staticmethod
+    def decode(data: Union[bytes, str]) -> dict[str, Any]:
+        event = json.loads(data)
+        if (
+            not isinstance(event, dict)
+            or not isinstance(event.get("type"), str)
+            or not isinstance(event.get("shard"), int)
+        ):
+            raise ValueError(f"Not a shard event: {event!r}")
+        return event
+
+    async def _subscribe(self, on_subscribed: Callable[[], None]) -> None:
+        pubsub = self.players.redis.pubsub()
+        try:
+            await pubsub.subscribe(self.channel)
+            on_subscribed()
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                try:
+                    event = self.decode(message["data"])
+                except ValueError:
+                    # Such as from a shard of another version during a restart
+                    logger.warning("Ignored malformed shard event %r", message["data"])
+                    continue
+                if event["shard"] == self.players.shard_index:
+                    continue
+                try:
+                    await self.players.handle_shard_event(event)
+                except Exception:
+                    logger.exception("Failed to handle shard event %s", event)
+        finally:
+            # The connection may be gone already, only release it
+            await pubsub.aclose()
+
+    async def _listen(self) -> None:
+        delay = self.RECONNECT_DELAY
+
+        def subscribed() -> None:
+            nonlocal delay
+            delay = self.RECONNECT_DELAY
+
+        # Without the channel this shard would silently stop getting joins,
+        # targets and id cards, so it always subscribes again. Events
+        # published meanwhile are lost.
+        while True:
+            try:
+                await self._subscribe(subscribed)
+                reason = "connection closed"
+            except (aioredis.RedisError, OSError) as e:
+                reason = repr(e)
+            self.reconnects += 1
+            logger.warning(
+                "Lost shard channel %s (%s), reconnecting in %.1fs",
+                self.channel,
+                reason,
+                delay,
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+
+    def start(self) -> None:
+        if self.future is None:
+            self.future = asyncio.create_task(self._listen())
+
+    def stop(self) -> None:
+        if self.future is not None:
+            self.future.cancel()
+            self.future = None
+
+
+class ReplyRouter:
+    """Route werewolf bot private messages of one client to pending waiters.
+
+    A single handler is installed per client for its whole lifetime. Join
+    trackers register a future under their join key and the router resolves
+    it with the reply type, oldest waiter first, since the werewolf bot
+    doesn't echo the key back.
+    """
+
+    JOINED = "joined"
+    ALREADY_IN_GAME = "already_in_game"
+
+    def __init__(self, client: Client):
         self.client = client
-        self.key = key
-        self.future: Optional[concurrent.futures.Future] = None
+        self.waiters: OrderedDict[str, asyncio.Future] = OrderedDict()
         self.handler = MessageHandler(
             self.message_handler, filters.chat(Players.WEREWOLF_BOT_ID) & filters.text
         )
+        self.client.add_handler(self.handler, -1)
+
+    @classmethod
+    def classify(cls, text: str) -> Optional[str]:
+        if "你已加入" in text and "的遊戲中" in text:
+            return cls.JOINED
+        if "You are already in a game!" in text:
+            return cls.ALREADY_IN_GAME
+        return None
+
+    def register(self, key: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[key] = future
+        return future
+
+    def discard(self, key: str, future: asyncio.Future) -> None:
+        if self.waiters.get(key) is future:
+            del self.waiters[key]
+
+    def close(self) -> None:
+        self.client.remove_handler(self.handler, -1)
+        for future in self.waiters.values():
+            future.cancel()
+        self.waiters.clear()
+
+    async def message_handler(self, _client: Client, msg: Message) -> None:
+        if (reply_type := self.classify(msg.text)) is None or not self.waiters:
+            return
+        _key, future = self.waiters.popitem(last=False)
+        if not future.done():
+            future.set_result(reply_type)
+
+
+class JoinGameTracker:
+    def __init__(
+        self,
+        router: ReplyRouter,
+        limiter: RateLimiter,
+        key: str,
+        retries: int = 3,
+        backoff: float = 10,
+    ):
+        self.router = router
+        self.limiter = limiter
+        self.client = router.client
+        self.key = key
+        self.retries = retries
+        self.backoff = backoff
+        self.future: Optional[asyncio.Task] = None
 
     def cancel(self) -> None:
         if self.future is not None:
             self.future.cancel()
             self.future = None
-            self.client.remove_handler(self.handler, -1)
             logger.debug("%s: Canceled!", self.client.name)
 
     async def _send(self) -> None:
         logger.debug("%s: Started!", self.client.name)
-        self.client.add_handler(self.handler, -1)
-        for x in range(3):
-            await self.client.send_message(
-                Players.WEREWOLF_BOT_ID, f"/start {self.key}"
-            )
-            await asyncio.sleep(10)
+        waiter = self.router.register(self.key)
+        started_at = time.monotonic()
+        try:
+            for x in range(self.retries):
+                await self.limiter.call(
+                    self.client.send_message,
+                    Players.WEREWOLF_BOT_ID,
+                    f"/start {self.key}",
+                )
+                # Exponential backoff with jitter between retries
+                timeout = self.backoff * 2**x * random.uniform(0.8, 1.2)
+                try:
+                    reply_type = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+                except asyncio.TimeoutError:
+                    continue
+                if reply_type == ReplyRouter.ALREADY_IN_GAME:
+                    logger.info("%s: Already in a game, Canceled", self.client.name)
+                else:
+                    metrics.JOIN_LATENCY.observe(
+                        time.monotonic() - started_at, self.client.name
+                    )
+                return
+        finally:
+            self.router.discard(self.key, waiter)
 
     def create_task(self) -> None:
         if self.future is None:
@@ -76,38 +415,583 @@ class JoinGameTracker:
         if self.future is not None:
             await asyncio.wait((self.future,))
 
-    async def message_handler(self, _client: Client, msg: Message) -> None:
-        if "你已加入" in msg.text and "的遊戲中" in msg.text:
-            self.cancel()
-        elif "You are already in a game!" in msg.text:
-            logger.info("%s, Canceled", msg.text)
-            self.cancel()
-
     @classmethod
-    def create(cls, client: Client, key: str) -> JoinGameTracker:
-        self = cls(client, key)
+    def create(
+        cls, router: ReplyRouter, limiter: RateLimiter, key: str, **kwargs: Any
+    ) -> JoinGameTracker:
+        self = cls(router, limiter, key, **kwargs)
         self.create_task()
         return self
 
 
+class EventMatcher:
+    """Find which events a werewolf bot group message fires.
+
+    Phrases of every event and locale are compiled into a single flat
+    alternation regex, so a message is scanned once however many phrases are
+    configured, and the matched phrase maps back to its event.
+    """
+
+    ID_CARD = "id_card"
+    GAME_END = "game_end"
+
+    DEFAULT_PATTERNS: dict[str, list[str]] = {
+        ID_CARD: [
+            "和事佬",
+            "銀渣",
+            "哼着",
+            "回到家中哼起",
+            "出示了來自官方",
+            "捣蛋",
+            "一聲槍聲",
+        ],
+    }
+
+    def __init__(self, patterns: dict[str, list[str]]):
+        self.patterns = patterns
+        self._phrase_events: dict[str, str] = {
+            phrase: event for event, phrases in patterns.items() for phrase in phrases
+        }
+        # Longest first, so a phrase never hides a longer one it prefixes.
+        # No groups, which keeps the first character fast path of re.
+        self._regex = (
+            re.compile(
+                "|".join(
+                    map(re.escape, sorted(self._phrase_events, key=len, reverse=True))
+                )
+            )
+            if self._phrase_events
+            else None
+        )
+
+    @classmethod
+    def from_file(cls, path: str) -> EventMatcher:
+        config = ConfigParser()
+        if not config.read(path, encoding="utf-8"):
+            logger.warning("Event pattern file %s not found, use defaults", path)
+            return cls(cls.DEFAULT_PATTERNS)
+        return cls(
+            {
+                event: [
+                    phrase.strip()
+                    for locale in config.options(event)
+                    for phrase in config.get(event, locale).split(",")
+                    if phrase.strip()
+                ]
+                for event in config.sections()
+            }
+        )
+
+    def match(self, text: str) -> set[str]:
+        if self._regex is None:
+            return set()
+        # findall returns the matched strings without building match objects,
+        # and most messages match nothing
+        found = self._regex.findall(text)
+        return {self._phrase_events[x] for x in found} if found else set()
+
+
+@dataclass(frozen=True)
+class CallbackData:
+    """Structured form of werewolf bot inline button callback data.
+
+    The werewolf bot encodes buttons as ``action|client|game_id|target``,
+    target being the voted user id (or a keyword such as ``skip``).
+    """
+
+    action: str
+    target_user_id: Optional[int]
+    game_id: str
+
+    @classmethod
+    def parse(cls, data: Optional[str]) -> CallbackData:
+        parts = (data or "").split("|")
+        game_id = parts[2] if len(parts) > 2 else ""
+        target_user_id = None
+        if len(parts) > 3 and parts[-1].isdigit():
+            target_user_id = int(parts[-1])
+        return cls(parts[0], target_user_id, game_id)
+
+    @classmethod
+    def parse_keyboard(cls, markup: InlineKeyboardMarkup) -> list[CallbackData]:
+        return [cls.parse(row[0].callback_data) for row in markup.inline_keyboard]
+
+
+GROUP_SECTION_RE = re.compile(r"group\.(-?\d+)")
+
+
+# Options only read at startup, a reload reports them instead of applying them
+RESTART_OPTIONS: set[tuple[str, str]] = {
+    ("account", "api_id"),
+    ("account", "api_hash"),
+    ("account", "count"),
+    ("account", "redis_key_suffix"),
+    ("account", "listener_mode"),
+    ("account", "startup"),
+    ("account", "startup_concurrency"),
+    ("account", "bot_id_cache"),
+}
+# The logging filters are only built by logs.setup at startup
+RESTART_SECTIONS: set[str] = {
+    "shard",
+    "storage",
+    "metrics",
+    "logging",
+    "logging.sample",
+    "logging.ratelimit",
+}
+
+
+def config_diff(old: ConfigParser, new: ConfigParser) -> set[tuple[str, str]]:
+    """(section, option) of every option added, removed or changed."""
+    keys = {
+        (section, option)
+        for config in (old, new)
+        for section in config.sections()
+        for option in config.options(section)
+    }
+    return {
+        key
+        for key in keys
+        if old.get(*key, fallback=None, raw=True)
+        != new.get(*key, fallback=None, raw=True)
+    }
+
+
+def group_sections(config: ConfigParser) -> dict[int, str]:
+    """Chat id -> name of its [group.<chat id>] override section."""
+    return {
+        int(match.group(1)): section
+        for section in config.sections()
+        if (match := GROUP_SECTION_RE.fullmatch(section))
+    }
+
+
+@dataclass
+class DelayWindow:
+    low: float
+    high: float
+    mode: float
+    # Seconds the werewolf bot gives to answer this kind of prompt
+    deadline: float
+
+
+class ClickScheduler:
+    """Pick when an account should answer an inline prompt.
+
+    Delays follow a triangular distribution inside the prompt type window,
+    are capped to leave ``safety_margin`` seconds before the phase deadline,
+    and clicks from our accounts in the same game are kept ``spread``
+    seconds apart.
+    """
+
+    LYNCH = decision.LYNCH
+    NIGHT = decision.NIGHT
+    SINGLE = decision.SINGLE
+
+    DEFAULT_WINDOWS: dict[str, DelayWindow] = {
+        LYNCH: DelayWindow(5, 15, 8, 60),
+        NIGHT: DelayWindow(5, 15, 8, 60),
+        SINGLE: DelayWindow(3, 10, 5, 60),
+    }
+
+    def __init__(
+        self,
+        windows: Optional[dict[str, DelayWindow]] = None,
+        safety_margin: float = 5,
+        spread: float = 1.5,
+    ):
+        self.windows = windows or self.DEFAULT_WINDOWS.copy()
+        self.safety_margin = safety_margin
+        self.spread = spread
+        # chat id -> windows overridden in its [group.<chat id>] section
+        self.group_windows: dict[int, dict[str, DelayWindow]] = {}
+        # game id -> earliest monotonic time the next click may be scheduled
+        self._next_slot: dict[str, float] = {}
+        # (prompt type, seconds left before deadline) of recent clicks
+        self.click_margins: deque[tuple[str, float]] = deque(maxlen=1000)
+
+    @staticmethod
+    def read_windows(
+        config: ConfigParser, section: str, base: dict[str, DelayWindow]
+    ) -> dict[str, DelayWindow]:
+        windows = base.copy()
+        for prompt_type, default in base.items():
+            low, high, mode = map(
+                float,
+                config.get(
+                    section,
+                    prompt_type,
+                    fallback=f"{default.low}, {default.high}, {default.mode}",
+                ).split(","),
+            )
+            deadline = config.getfloat(
+                section, f"{prompt_type}_deadline", fallback=default.deadline
+            )
+            windows[prompt_type] = DelayWindow(low, high, mode, deadline)
+        return windows
+
+    @classmethod
+    def from_config(cls, config: ConfigParser) -> ClickScheduler:
+        self = cls()
+        self.apply_config(config)
+        return self
+
+    def apply_config(self, config: ConfigParser) -> None:
+        """Take the windows of [delay] and every [group.<chat id>] section,
+        pending schedules are kept."""
+        self.windows = self.read_windows(config, "delay", self.DEFAULT_WINDOWS)
+        self.safety_margin = config.getfloat("delay", "safety_margin", fallback=5)
+        self.spread = config.getfloat("delay", "spread", fallback=1.5)
+        self.group_windows = {
+            chat_id: self.read_windows(config, section, self.windows)
+            for chat_id, section in group_sections(config).items()
+            if any(
+                config.has_option(section, x)
+                or config.has_option(section, f"{x}_deadline")
+                for x in self.windows
+            )
+        }
+
+    @classmethod
+    def classify(cls, msg: Message) -> str:
+        if msg.text and msg.text.startswith("你想處死誰"):
+            return cls.LYNCH
+        if len(msg.reply_markup.inline_keyboard) < 2:
+            return cls.SINGLE
+        return cls.NIGHT
+
+    def windows_of(self, chat_id: Optional[int]) -> dict[str, DelayWindow]:
+        return self.group_windows.get(chat_id, self.windows)
+
+    def schedule(
+        self,
+        prompt_type: str,
+        game_id: str,
+        arrived_at: float,
+        chat_id: Optional[int] = None,
+    ) -> float:
+        window = self.windows_of(chat_id)[prompt_type]
+        latest = arrived_at + window.deadline - self.safety_margin
+        click_at = arrived_at + random.triangular(window.low, window.high, window.mode)
+        click_at = min(max(click_at, self._next_slot.get(game_id, 0)), latest)
+        now = time.monotonic()
+        if len(self._next_slot) > 64:
+            self._next_slot = {k: v for k, v in self._next_slot.items() if v > now}
+        self._next_slot[game_id] = click_at + self.spread
+        return click_at
+
+    async def wait(
+        self,
+        prompt_type: str,
+        game_id: str,
+        arrived_at: float,
+        chat_id: Optional[int] = None,
+    ) -> None:
+        delay = (
+            self.schedule(prompt_type, game_id, arrived_at, chat_id) - time.monotonic()
+        )
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record(
+        self, prompt_type: str, arrived_at: float, chat_id: Optional[int] = None
+    ) -> float:
+        margin = (
+            arrived_at
+            + self.windows_of(chat_id)[prompt_type].deadline
+            - time.monotonic()
+        )
+        self.click_margins.append((prompt_type, margin))
+        logger.debug("Clicked %s prompt %.2fs before deadline", prompt_type, margin)
+        return margin
+
+
+class WorkerScheduler:
+    """Pick the accounts which join a new game.
+
+    Accounts still in an active game of another group are skipped, the
+    werewolf bot would only answer "You are already in a game!". Free ones
+    are ranked by FloodWait state, recent calls and games joined, so games
+    spread over the whole pool instead of always the first accounts.
+    """
+
+    def __init__(self, game_timeout: float = 3600):
+        # Games are released on game end, this covers missed game end messages
+        self.game_timeout = game_timeout
+        # chat id -> (joined at, names of the accounts playing there)
+        self.games: dict[int, tuple[float, set[str]]] = {}
+        self.joins: Counter[str] = Counter()
+        self.short_games = 0
+
+    def busy(self, now: float) -> dict[str, int]:
+        for chat_id in [
+            chat_id
+            for chat_id, (joined_at, _names) in self.games.items()
+            if now - joined_at > self.game_timeout
+        ]:
+            del self.games[chat_id]
+        return {
+            name: chat_id
+            for chat_id, (_, names) in self.games.items()
+            for name in names
+        }
+
+    def assign(
+        self,
+        chat_id: int,
+        clients: list[Client],
+        worker_num: int,
+        limiters: dict[str, RateLimiter],
+    ) -> list[Client]:
+        now = time.monotonic()
+        # A new game in the group means the previous one is over
+        self.release(chat_id)
+        busy = self.busy(now)
+        chosen = sorted(
+            (x for x in clients if x.name not in busy),
+            key=lambda x: (
+                limiters[x.name].flooded(now),
+                round(limiters[x.name].recent_load(now)),
+                self.joins[x.name],
+            ),
+        )[:worker_num]
+        if len(chosen) < worker_num:
+            self.short_games += 1
+            logger.info(
+                "Only %d of %d workers are free for %d",
+                len(chosen),
+                worker_num,
+                chat_id,
+            )
+        self.games[chat_id] = (now, {x.name for x in chosen})
+        self.joins.update(x.name for x in chosen)
+        for x in chosen:
+            metrics.ACCOUNT_JOINS.inc(x.name)
+        return chosen
+
+    def release(self, chat_id: int) -> None:
+        self.games.pop(chat_id, None)
+
+    def fairness(self, names: list[str]) -> float:
+        """Jain's index of games joined, 1 when every account joined as many
+        games and 1/n when a single one joined them all."""
+        counts = [self.joins[x] for x in names]
+        if not (square_sum := sum(x * x for x in counts)):
+            return 1
+        return sum(counts) ** 2 / (len(counts) * square_sum)
+
+    def stats(
+        self, clients: list[Client], limiters: dict[str, RateLimiter]
+    ) -> list[str]:
+        now = time.monotonic()
+        busy = self.busy(now)
+        names = [x.name for x in clients]
+        lines = [
+            f"{name}: games={self.joins[name]}, "
+            f"load={limiters[name].recent_load(now):.1f}, "
+            f"flood_waits={limiters[name].flood_waits}"
+            + (f", in {busy[name]}" if name in busy else "")
+            for name in names
+        ]
+        lines.append(
+            f"fairness={self.fairness(names):.3f}, short_games={self.short_games}"
+        )
+        return lines
+
+
+@dataclass(eq=False)
+class GameEntry:
+    chat_id: int
+    join_key: str
+    # Game id found in callback data, known after its first prompt
+    game_id: Optional[str] = None
+    expires_at: float = 0
+    # Order the games were added in, a game end is about the latest one
+    joined: int = 0
+    # Its game ended, using it no longer extends its expiry
+    finished: bool = False
+
+
+class GameRegistry:
+    """Games we joined, by join key and by the game id of callback data.
+
+    The werewolf bot only tells the game id in callback data, and it is part
+    of the join key, so the first prompt of a game scans the games not
+    resolved yet (a handful at most) and every later lookup is a dict hit.
+    Several games of the same group can be alive at once. A game is dropped
+    ``finish_grace`` seconds after its game end, ``ttl`` seconds after it was
+    last used, or when more than ``max_games`` are kept, least recently used
+    first.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 6 * 3600,
+        max_games: int = 1024,
+        finish_grace: float = 60,
+        on_evict: Optional[Callable[[GameEntry], None]] = None,
+    ):
+        self.ttl = ttl
+        self.max_games = max_games
+        self.finish_grace = finish_grace
+        self.on_evict = on_evict
+        # Least recently used first
+        self.entries: OrderedDict[GameEntry, None] = OrderedDict()
+        self.by_key: dict[str, GameEntry] = {}
+        self.by_game_id: dict[str, GameEntry] = {}
+        self.unresolved: set[GameEntry] = set()
+        self._joined = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _touch(self, entry: GameEntry, now: float) -> None:
+        if not entry.finished:
+            entry.expires_at = now + self.ttl
+        self.entries.move_to_end(entry)
+
+    def _remove(self, entry: GameEntry) -> None:
+        del self.entries[entry]
+        if self.by_key.get(entry.join_key) is entry:
+            del self.by_key[entry.join_key]
+        if entry.game_id is not None and self.by_game_id.get(entry.game_id) is entry:
+            del self.by_game_id[entry.game_id]
+        self.unresolved.discard(entry)
+        if self.on_evict is not None:
+            self.on_evict(entry)
+
+    def evict(self, now: float) -> None:
+        for entry in [x for x in self.entries if x.expires_at <= now]:
+            self._remove(entry)
+        while len(self.entries) > self.max_games:
+            self._remove(next(iter(self.entries)))
+
+    def add(self, chat_id: int, join_key: str) -> GameEntry:
+        now = time.monotonic()
+        if (entry := self.by_key.get(join_key)) is None:
+            entry = GameEntry(chat_id, join_key, joined=next(self._joined))
+            self.entries[entry] = None
+            self.by_key[join_key] = entry
+            self.unresolved.add(entry)
+        self._touch(entry, now)
+        self.evict(now)
+        return entry
+
+    def restore(self, game_id: str, chat_id: int) -> None:
+        """Re-attach a game id resolved before a restart."""
+        for entry in self.unresolved:
+            if entry.chat_id == chat_id and game_id in entry.join_key:
+                break
+        else:
+            # The join key is lost, only callback lookups can find it
+            entry = GameEntry(chat_id, "", joined=next(self._joined))
+            self.entries[entry] = None
+        self._resolve(entry, game_id)
+        self._touch(entry, time.monotonic())
+
+    def _resolve(self, entry: GameEntry, game_id: str) -> None:
+        entry.game_id = game_id
+        self.by_game_id[game_id] = entry
+        self.unresolved.discard(entry)
+
+    def get_by_key(self, join_key: str) -> Optional[GameEntry]:
+        return self.by_key.get(join_key)
+
+    def resolve(self, game_id: str) -> tuple[Optional[GameEntry], bool]:
+        """Find the game of a callback game id, and if it was a new match."""
+        if not game_id:
+            # Any join key would contain it
+            return None, False
+        now = time.monotonic()
+        if (entry := self.by_game_id.get(game_id)) is not None:
+            if entry.expires_at > now:
+                self._touch(entry, now)
+                return entry, False
+            self._remove(entry)
+            return None, False
+        for entry in self.unresolved:
+            if game_id in entry.join_key:
+                self._resolve(entry, game_id)
+                self._touch(entry, now)
+                return entry, True
+        return None, False
+
+    def finish(self, chat_id: int) -> None:
+        """Expire the latest joined game of ``chat_id`` soon, late prompts of
+        it can still be resolved meanwhile."""
+        entry = max(
+            (x for x in self.entries if x.chat_id == chat_id),
+            key=lambda x: x.joined,
+            default=None,
+        )
+        if entry is None or entry.finished:
+            return
+        entry.finished = True
+        entry.expires_at = min(entry.expires_at, time.monotonic() + self.finish_grace)
+
+
 @dataclass(init=False)
 class GameConfig:
     enabled: bool
     worker_num: int
-    id_cards: list[str]
+    id_cards: set[int]
     _default_worker_num: int
     group_join_string: str
+    force_human_override: bool
+    target: str
+    force_human: bool
+    policy: Optional[decision.Policy]
 
     def __init__(self, enabled: bool, worker_num: int):
         self.enabled = enabled
         self.worker_num = worker_num
-        self.id_cards = []
+        self.id_cards = set()
         self._default_worker_num = worker_num
         self.group_join_string = ""
+        # force_target_human of its [group.<chat id>] section, always vote for
+        # humans in this group whatever the owner set
+        self.force_human_override = False
+        # Set by /target for the current game, the next game clears them
+        self.target = ""
+        self.force_human = False
+        # None uses the policy of [account]
+        self.policy = None
 
     def clear_id_cards(self) -> None:
         self.id_cards.clear()
 
+    def clear_target(self) -> bool:
+        """Returns whether there was a target to clear."""
+        if not (self.target or self.force_human):
+            return False
+        self.target, self.force_human = "", False
+        return True
+
+    def decision_state(self, bot_ids: set[int]) -> decision.GroupState:
+        return decision.GroupState(
+            # Forcing humans by /target h overrides the target, as before
+            "" if self.force_human else self.target,
+            self.force_human or self.force_human_override,
+            self.id_cards.copy(),
+            bot_ids,
+        )
+
+    def apply_options(self, options: dict[str, str]) -> None:
+        """Take the changed options of its [group.<chat id>] section."""
+        if "enabled" in options:
+            self.enabled = ConfigParser.BOOLEAN_STATES[options["enabled"].lower()]
+        if "workers" in options:
+            self.worker_num = self._default_worker_num = int(options["workers"])
+        if "force_target_human" in options:
+            self.force_human_override = ConfigParser.BOOLEAN_STATES[
+                options["force_target_human"].lower()
+            ]
+        if "policy" in options:
+            self.policy = (
+                decision.create_policy(options["policy"]) if options["policy"] else None
+            )
+
     def reset(self) -> None:
         self.enabled = True
         self.worker_num = self._default_worker_num
@@ -119,18 +1003,85 @@ class Players:
 
     WEREWOLF_BOT_ID: int = 175844556
 
-    def __init__(self, redis: aioredis.Redis):
+    def __init__(
+        self, state_store: StateBackend, shard_index: int = 0, shard_count: int = 1
+    ):
         self.client_group: list[Client] = []
-        self.redis = redis
-        self.TARGET: str = ""
-        self.FORCE_TARGET_HUMAN: bool = False
-        self.lock: asyncio.Lock = asyncio.Lock()
+        # Accounts configured across every shard, client_group only holds the
+        # accounts of this shard
+        self.account_count: int = 0
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.coordinator: Optional[ShardCoordinator] = None
+        self.state_store = state_store
+        # Sharding coordinates through redis, only available with that backend
+        self.redis: Optional[aioredis.Redis] = (
+            state_store.redis if isinstance(state_store, RedisBackend) else None
+        )
+        # Decision policy of groups without their own
+        self.policy: decision.Policy = decision.DefaultPolicy()
         self._listen_to_group: list[int] = [0]
+        self._listen_to_set: set[int] = set()
+        # Shared by every listener handler, updated in place on reload
+        self.listen_filter: filters.chat = filters.chat()
         self.owner: int = 0
-        self.BOT_LIST: list[str] = []
+        self.bot_ids: set[int] = set()
         self.redis_key_suffix: str = "werewolf_bot"
         self.game_configs: dict[int, GameConfig] = {}
-        self.game_identification_mapping: dict[str, int] = {}
+        self.game_registry: GameRegistry = GameRegistry(on_evict=self.forget_game)
+        self.click_scheduler: ClickScheduler = ClickScheduler()
+        self.worker_scheduler: WorkerScheduler = WorkerScheduler()
+        self.event_matcher: EventMatcher = EventMatcher(EventMatcher.DEFAULT_PATTERNS)
+        self.recorder: Optional[transcript.Recorder] = None
+        self.metrics_server: Optional[metrics.MetricsServer] = None
+        self.diagnostics: diagnostics.Diagnostics = diagnostics.Diagnostics()
+        # Long running command replies, referenced until they finish
+        self._command_tasks: set[asyncio.Task] = set()
+        # eager, staged or lazy, see start
+        self.startup_mode: str = "eager"
+        self.startup_concurrency: int = 4
+        # JSON file of session name -> user id, saves get_me at every boot
+        self.bot_id_cache: Optional[str] = None
+        self.account_ids: dict[str, int] = {}
+        self._client_starts: dict[str, asyncio.Task] = {}
+        self._startup_future: Optional[asyncio.Task] = None
+        self.started_at: float = 0
+        self.first_join_at: Optional[float] = None
+        # session name -> Client, used to add accounts at runtime
+        self.client_factory: Optional[Callable[[str], Client]] = None
+        # accounts which finish their current games but join no new ones
+        self.draining: set[str] = set()
+        # config.ini as last applied, reloads are diffed against it
+        self.config: ConfigParser = ConfigParser()
+        # client name -> reply router of werewolf bot private messages
+        self.routers: dict[str, ReplyRouter] = {}
+        # client name -> limiter of every outgoing call made by that client
+        self.rate_limiters: dict[str, RateLimiter] = {}
+        self.rate_limit_burst: int = 5
+        self.rate_limit_refill: float = 1.0
+        self.join_retries: int = 3
+        self.join_backoff: float = 10
+        # single: only the first account listens to groups, elect: every
+        # account listens and ListenerElection picks who handles an update
+        self.listener_mode: str = "single"
+        self.election: ListenerElection = ListenerElection()
+        # command -> handler, and if only the owner may use it in groups
+        self._group_commands: dict[str, tuple[Callable, bool]] = {
+            "resend": (self.handle_resend_command, True),
+            "off": (self.handle_close_auto_join, False),
+            "setw": (self.handle_set_num_worker, False),
+        }
+        self._owner_commands: dict[str, Callable] = {
+            "target": self.handle_set_target,
+            "debug": self.handle_toggle_debug_command,
+            "ratelimit": self.handle_rate_limit_command,
+            "account": self.handle_account_command,
+            "workers": self.handle_workers_command,
+            "profile": self.handle_profile_command,
+            "mem": self.handle_memory_command,
+            "tasks": self.handle_tasks_command,
+            "reload": self.handle_reload_command,
+        }
 
     @property
     def listen_to_group(self) -> list[int]:
@@ -146,92 +1097,235 @@ class Players:
                 2,
             )
         self._listen_to_group = value
-        logger.debug("Set listen group to %s", str(self.listen_to_group))
+        self._listen_to_set = set(value)
+        self.listen_filter.clear()
+        self.listen_filter.update(value)
+        logger.debug("Set listen group to %s", self.listen_to_group)
 
     @classmethod
-    async def create(cls) -> Players:
+    async def create(cls, shard_index: int = 0) -> Players:
         logger.info("Creating bot instance")
-        self = cls(await aioredis.from_url("redis://localhost"))
         config = ConfigParser()
         config.read("config.ini")
-        self.listen_to_group = ast.literal_eval(config.get("account", "listen_to"))
-        self.owner = config.getint("account", "owner", fallback=0)
-        for _x in range(config.getint("account", "count")):
-            self.client_group.append(
-                Client(
-                    f"werewolf{_x}",
-                    api_id=config.getint("account", "api_id"),
-                    api_hash=config.get("account", "api_hash"),
-                    app_version="werewolf",
-                )
-            )
-        worker_num = len(self.client_group)
-        for group in self.listen_to_group:
-            self.game_configs.update({group: GameConfig(True, worker_num)})
-        self.redis_key_suffix = config.get(
+        redis_key_suffix = config.get(
             "account", "redis_key_suffix", fallback="werewolf_bot"
         )
+        self = cls(
+            await create_backend(config, redis_key_suffix),
+            shard_index,
+            config.getint("shard", "count", fallback=1),
+        )
+        self.redis_key_suffix = redis_key_suffix
+        self.account_count = config.getint("account", "count")
+        self.client_factory = functools.partial(
+            Client,
+            api_id=config.getint("account", "api_id"),
+            api_hash=config.get("account", "api_hash"),
+            app_version="werewolf",
+        )
+        for _x in range(self.account_count):
+            if _x % self.shard_count != self.shard_index:
+                continue
+            self.client_group.append(self.client_factory(f"werewolf{_x}"))
+        self.listener_mode = config.get("account", "listener_mode", fallback="single")
+        if self.listener_mode not in ("single", "elect"):
+            raise ValueError(f"Unknown listener_mode: {self.listener_mode}")
+        self.startup_mode = config.get("account", "startup", fallback="eager")
+        if self.startup_mode not in ("eager", "staged", "lazy"):
+            raise ValueError(f"Unknown startup mode: {self.startup_mode}")
+        self.startup_concurrency = config.getint(
+            "account", "startup_concurrency", fallback=4
+        )
+        self.bot_id_cache = (
+            config.get("account", "bot_id_cache", fallback="bot_ids.json") or None
+        )
+        if self.bot_id_cache is not None and self.shard_count > 1:
+            root, ext = os.path.splitext(self.bot_id_cache)
+            self.bot_id_cache = f"{root}.{self.shard_index}{ext}"
+        self.apply_config(config, save=False)
+        if config.getboolean("metrics", "enabled", fallback=False):
+            # Every shard process serves its own metrics on the next port
+            self.metrics_server = metrics.MetricsServer(
+                config.get("metrics", "host", fallback="127.0.0.1"),
+                config.getint("metrics", "port", fallback=9464) + shard_index,
+            )
+        if self.shard_count > 1:
+            if self.redis is None:
+                raise ValueError("Sharding requires the redis storage backend")
+            self.coordinator = ShardCoordinator(self, f"{self.redis_key_suffix}_shard")
         self.init_message_handler()
         return self
 
-    def init_message_handler(self) -> None:
-        if self._listen_to_group[0] == 0:
-            raise ValueError("listen_to_group value must be set")
-        self.client_group[0].add_handler(
-            MessageHandler(
-                self.handle_set_target,
-                filters.chat(self.owner) & filters.command("target"),
-            )
+    def apply_config(self, config: ConfigParser, save: bool = True) -> None:
+        """Apply every option which can change while running.
+
+        Groups dropped from ``listen_to`` are no longer listened to but keep
+        their ``GameConfig``, so their running games play on.
+        """
+        # Everything is read before anything is applied, so a bad value
+        # leaves the running config untouched
+        listen_to_group = ast.literal_eval(config.get("account", "listen_to"))
+        owner = config.getint("account", "owner", fallback=0)
+        ClickScheduler.from_config(config)
+        game_ttl = config.getfloat("account", "game_ttl", fallback=6 * 3600)
+        max_games = config.getint("account", "max_games", fallback=1024)
+        event_matcher = EventMatcher.from_file(
+            config.get("account", "event_patterns", fallback="events.ini")
         )
-        self.client_group[0].add_handler(
-            MessageHandler(
-                self.handle_resend_command,
-                filters.user(self.owner)
-                & filters.chat(self._listen_to_group)
-                & filters.command("resend"),
-            )
+        burst = config.getint("ratelimit", "burst", fallback=5)
+        refill_rate = config.getfloat("ratelimit", "refill_rate", fallback=1.0)
+        join_retries = config.getint("ratelimit", "join_retries", fallback=3)
+        join_backoff = config.getfloat("ratelimit", "join_backoff", fallback=10)
+        failover_delay = config.getfloat("account", "failover_delay", fallback=2)
+        slow_callback = config.getfloat("diagnostics", "slow_callback", fallback=0.1)
+        policy = decision.create_policy(
+            config.get("account", "policy", fallback=decision.DefaultPolicy.name)
         )
-        self.client_group[0].add_handler(
-            MessageHandler(
-                self.handle_toggle_debug_command,
-                filters.chat(self.owner) & filters.command("debug"),
-            )
+        for section in group_sections(config).values():
+            config.getint(section, "workers", fallback=1)
+            config.getboolean(section, "enabled", fallback=True)
+            config.getboolean(section, "force_target_human", fallback=False)
+            if group_policy := config.get(section, "policy", fallback=""):
+                decision.create_policy(group_policy)
+
+        old, self.config = self.config, config
+        self.listen_to_group = listen_to_group
+        self.owner = owner
+        for group in self.listen_to_group:
+            if group not in self.game_configs:
+                self.game_configs[group] = GameConfig(True, self.account_count)
+        self.click_scheduler.apply_config(config)
+        self.game_registry.ttl = game_ttl
+        self.game_registry.max_games = max_games
+        self.event_matcher = event_matcher
+        self.rate_limit_burst = burst
+        self.rate_limit_refill = refill_rate
+        for limiter in self.rate_limiters.values():
+            limiter.burst = burst
+            limiter.refill_rate = refill_rate
+        self.join_retries = join_retries
+        self.join_backoff = join_backoff
+        self.election.failover_delay = failover_delay
+        self.diagnostics.directory = config.get(
+            "diagnostics", "directory", fallback="diagnostics"
         )
-        self.client_group[0].add_handler(
-            MessageHandler(
-                self.handle_normal_resident,
-                filters.chat(self._listen_to_group)
-                & filters.user(self.WEREWOLF_BOT_ID)
-                & filters.text,
+        self.diagnostics.slow_callback = slow_callback
+        self.policy = policy
+        self.apply_group_options(old, config, save)
+
+    def apply_group_options(
+        self,
+        old: ConfigParser,
+        new: ConfigParser,
+        save: bool = True,
+        chat_ids: Optional[set[int]] = None,
+    ) -> None:
+        """Apply the [group.<chat id>] options which differ between ``old``
+        and ``new``, so /setw and /off stick until the option changes."""
+        defaults = {
+            "enabled": "true",
+            "workers": str(self.account_count),
+            "force_target_human": "false",
+            "policy": "",
+        }
+        old_sections, new_sections = group_sections(old), group_sections(new)
+        for chat_id in old_sections.keys() | new_sections.keys():
+            if (config := self.game_configs.get(chat_id)) is None or (
+                chat_ids is not None and chat_id not in chat_ids
+            ):
+                continue
+            before = (
+                dict(old.items(old_sections[chat_id]))
+                if chat_id in old_sections
+                else {}
             )
-        )
-        self.client_group[0].add_handler(
-            MessageHandler(
-                self.handle_join_game,
-                filters.chat(self._listen_to_group)
-                & filters.user(self.WEREWOLF_BOT_ID),
+            after = (
+                dict(new.items(new_sections[chat_id]))
+                if chat_id in new_sections
+                else {}
             )
+            changed = {
+                key: after.get(key, default)
+                for key, default in defaults.items()
+                if before.get(key) != after.get(key)
+            }
+            if not changed:
+                continue
+            config.apply_options(changed)
+            config.worker_num = max(min(config.worker_num, self.account_count), 1)
+            if save:
+                self.save_game(chat_id)
+
+    async def reload_config(self, path: str = "config.ini") -> list[str]:
+        """Re-read ``path`` and apply what changed, returns what changed."""
+        config = ConfigParser()
+        if not config.read(path):
+            raise ValueError(f"Can't read {path}")
+        changed = config_diff(self.config, config)
+        added = set(ast.literal_eval(config.get("account", "listen_to"))) - set(
+            self.game_configs
         )
-        self.client_group[0].add_handler(
-            MessageHandler(
-                self.handle_close_auto_join,
-                filters.chat(self._listen_to_group) & filters.command("off"),
-            )
+        self.apply_config(config)
+        if added:
+            state = await self.state_store.load(list(added))
+            for chat_id, game in state.games.items():
+                self.apply_game_state(chat_id, game)
+            # Options of the config win over the stored state of new groups
+            self.apply_group_options(ConfigParser(), config, chat_ids=added)
+        restart = sorted(
+            f"{section}.{option}"
+            for section, option in changed
+            if section in RESTART_SECTIONS or (section, option) in RESTART_OPTIONS
         )
-        self.client_group[0].add_handler(
+        lines = [
+            f"Reloaded {len(changed) - len(restart)} option(s)",
+            f"Listening to {len(self.listen_to_group)} group(s)",
+        ]
+        if added:
+            lines.append(f"Added {', '.join(map(str, sorted(added)))}")
+        if restart:
+            lines.append(f"Restart to apply {', '.join(restart)}")
+        logger.info("Config reloaded: %s", "; ".join(lines))
+        return lines
+
+    async def reload_config_from_signal(self) -> None:
+        try:
+            await self.reload_config()
+        except (ValueError, SyntaxError, configparser.Error):
+            logger.exception("Failed to reload config")
+
+    def init_message_handler(self) -> None:
+        if self._listen_to_group[0] == 0:
+            raise ValueError("listen_to_group value must be set")
+        for listener in self.listener_clients():
+            self.setup_listener(listener)
+        for x in self.client_group:
+            self.setup_client(x)
+        logger.debug("Current workers: %d", len(self.client_group))
+
+    def setup_listener(self, client: Client) -> None:
+        # In elect mode every account listens, a gate handler in front of the
+        # group handlers lets only one of them handle each update.
+        if self.listener_mode == "elect":
+            client.add_handler(
+                MessageHandler(self.handle_listener_gate, self.listen_filter),
+                -2,
+            )
+        # A single router in its own handler group, so it never shadows
+        # handle_werewolf_game in group 0
+        client.add_handler(MessageHandler(self.handle_listener_message), 1)
+
+    def setup_client(self, client: Client) -> None:
+        client.add_handler(
             MessageHandler(
-                self.handle_set_num_worker,
-                filters.chat(self._listen_to_group) & filters.command("setw"),
+                self.handle_werewolf_game,
+                filters.chat(self.WEREWOLF_BOT_ID) & filters.incoming,
             )
         )
-        for x in self.client_group:
-            x.add_handler(
-                MessageHandler(
-                    self.handle_werewolf_game,
-                    filters.chat(self.WEREWOLF_BOT_ID) & filters.incoming,
-                )
-            )
-        logger.debug("Current workers: %d", len(self.client_group))
+        self.routers[client.name] = ReplyRouter(client)
+        self.rate_limiters[client.name] = RateLimiter(
+            client.name, self.rate_limit_burst, self.rate_limit_refill
+        )
 
     @staticmethod
     async def safe_start_or_stop(client: Client, method: Coroutine) -> Optional[str]:
@@ -252,86 +1346,583 @@ class Players:
             )
             return client.name
 
-    async def start(self) -> None:
-        logger.info("Starting clients")
-        results = await asyncio.gather(
-            *(self.safe_start_or_stop(x, x.start()) for x in self.client_group)
-        )
-
-        fail_count = 0
-        for result in results:
-            if result is not None:
-                for client in self.client_group:
-                    if result == client.name:
-                        self.client_group.remove(client)
-                        fail_count += 1
-                        break
-        if fail_count > 0:
-            for group_id, config in self.game_configs.items():
-                config.worker_num = len(self.client_group)
+    def save_game(self, chat_id: int) -> None:
+        config = self.game_configs[chat_id]
+        self.state_store.set_game(
+            chat_id, config.enabled, config.worker_num, config.group_join_string
+        )
+
+    def save_target(self, chat_id: int) -> None:
+        config = self.game_configs[chat_id]
+        self.state_store.set_target(chat_id, config.target, config.force_human)
+
+    async def load_state(self) -> None:
+        async with metrics.STORAGE_LATENCY.time(self.state_store.name, "load"):
+            state = await self.state_store.load(list(self.game_configs))
+        for chat_id, game in state.games.items():
+            self.apply_game_state(chat_id, game)
+        for game_id, chat_id in state.identification.items():
+            # An empty game id was stored by earlier versions for url buttons
+            if game_id and chat_id in self.game_configs:
+                self.game_registry.restore(game_id, chat_id)
+            else:
+                self.state_store.remove_identification(game_id)
+        # Options of the config win over the stored state at startup
+        self.apply_group_options(ConfigParser(), self.config, save=False)
+        logger.debug("Loaded state of %d group(s)", len(state.games))
+
+    def apply_game_state(self, chat_id: int, game: GameState) -> None:
+        config = self.game_configs[chat_id]
+        config.enabled = game.enabled
+        if game.worker_num is not None:
+            config.worker_num = min(game.worker_num, self.account_count)
+        config.group_join_string = game.group_join_string
+        config.id_cards = game.id_cards
+        config.target = game.target
+        config.force_human = game.force_human
+        if game.group_join_string:
+            self.game_registry.add(chat_id, game.group_join_string)
+
+    def listener_clients(self) -> list[Client]:
+        if self.shard_index != 0:
+            # Groups are only listened to by shard 0
+            return []
+        if self.listener_mode == "elect":
+            return self.client_group
+        return self.client_group[:1]
+
+    def get_client(self, name: str) -> Optional[Client]:
+        for client in self.client_group:
+            if client.name == name:
+                return client
+        return None
+
+    def remove_clients(self, names: list[str]) -> None:
+        """Drop clients from the pool and shrink every worker num."""
+        for name in names:
+            if (client := self.get_client(name)) is not None:
+                self.client_group.remove(client)
+                self.routers.pop(client.name).close()
+                self.rate_limiters.pop(client.name)
+                self.draining.discard(client.name)
+                self._client_starts.pop(client.name, None)
+        self.account_count -= len(names)
+        for group_id, config in self.game_configs.items():
+            config.worker_num = min(config.worker_num, self.account_count)
+        if self.election.leader not in (x.name for x in self.client_group):
+            self.election.leader = (
+                self.client_group[0].name if self.client_group else None
+            )
+
+    def load_bot_id_cache(self) -> dict[str, int]:
+        if self.bot_id_cache is None:
+            return {}
+        try:
+            with open(self.bot_id_cache) as fin:
+                return json.load(fin)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logger.exception("Failed to read bot id cache %s", self.bot_id_cache)
+            return {}
+
+    def save_bot_id_cache(self) -> None:
+        if self.bot_id_cache is None:
+            return
+        try:
+            with open(f"{self.bot_id_cache}.tmp", "w") as fout:
+                json.dump(self.account_ids, fout)
+            os.replace(f"{self.bot_id_cache}.tmp", self.bot_id_cache)
+        except OSError:
+            logger.exception("Failed to write bot id cache %s", self.bot_id_cache)
+
+    async def _start_client(self, client: Client) -> bool:
+        try:
+            failed = await self.safe_start_or_stop(client, client.start()) is not None
+        except Exception:
+            # Anything else, such as a lost connection or a revoked session,
+            # must not surface in every game that picked this account
+            logger.exception("Failed to start %s", client.name)
+            failed = True
+        if failed:
+            self.remove_clients([client.name])
             logger.warning(
-                "Found %d client(s) couldn't start, resize worker num to %d",
-                fail_count,
-                len(self.client_group),
+                "%s couldn't start, resize worker num to %d",
+                client.name,
+                self.account_count,
             )
+            return False
+        if self.account_ids.get(client.name) != client.me.id:
+            # Unknown account or the session was logged in to another one
+            if (old_id := self.account_ids.get(client.name)) is not None:
+                self.bot_ids.discard(old_id)
+            self.account_ids[client.name] = client.me.id
+            self.bot_ids.add(client.me.id)
+            self.save_bot_id_cache()
+            if self.coordinator is not None:
+                await self.redis.sadd(f"{self.redis_key_suffix}_bots", client.me.id)
+                await self.coordinator.publish("bots", ids=[client.me.id])
+        return True
 
-        self.BOT_LIST.clear()
-        self.BOT_LIST.extend(
-            map(
-                lambda u: str(u.id),
-                await asyncio.gather(*(x.get_me() for x in self.client_group)),
+    async def ensure_started(self, client: Client) -> bool:
+        """Start ``client`` once, callers share the same start."""
+        if (task := self._client_starts.get(client.name)) is None:
+            task = self._client_starts[client.name] = asyncio.create_task(
+                self._start_client(client)
             )
+        return await asyncio.shield(task)
+
+    def is_started(self, client: Client) -> bool:
+        task = self._client_starts.get(client.name)
+        return (
+            task is not None
+            and task.done()
+            and not task.cancelled()
+            and task.exception() is None
+            and task.result()
+        )
+
+    async def _start_workers(self, clients: list[Client]) -> None:
+        semaphore = asyncio.Semaphore(self.startup_concurrency)
+
+        async def start(client: Client) -> None:
+            async with semaphore:
+                await self.ensure_started(client)
+
+        await asyncio.gather(*(start(x) for x in clients))
+        metrics.STARTUP.set("workers", value=time.monotonic() - self.started_at)
+        logger.info(
+            "Started %d workers in %.1fs",
+            len(clients),
+            time.monotonic() - self.started_at,
+        )
+
+    async def add_account(self, name: str) -> bool:
+        """Add the already authorized session ``name`` to the pool and start it."""
+        if self.get_client(name) is not None:
+            raise ValueError(f"{name} is already in the pool")
+        client = self.client_factory(name)
+        if self.listener_mode == "elect" and self.shard_index == 0:
+            self.setup_listener(client)
+        self.setup_client(client)
+        self.client_group.append(client)
+        self.account_count += 1
+        for chat_id, config in self.game_configs.items():
+            if config.worker_num == self.account_count - 1:
+                # Groups which used every account keep doing so
+                config.worker_num = self.account_count
+                self.save_game(chat_id)
+        return await self.ensure_started(client)
+
+    async def _stop_client(self, client: Client) -> None:
+        if (task := self._client_starts.pop(client.name, None)) is None:
+            return
+        await asyncio.wait((task,))
+        if not task.cancelled() and task.exception() is None and task.result():
+            await self.safe_start_or_stop(client, client.stop())
+
+    async def remove_account(self, name: str) -> None:
+        """Stop ``name`` and forget it, its games continue without it."""
+        if (client := self.get_client(name)) is None:
+            raise ValueError(f"{name} is not in the pool")
+        if self.listener_mode == "single" and client in self.listener_clients():
+            raise ValueError(f"{name} is the listener")
+        await self._stop_client(client)
+        if (user_id := self.account_ids.pop(name, None)) is not None:
+            self.bot_ids.discard(user_id)
+            self.save_bot_id_cache()
+        self.remove_clients([name])
+        logger.info("Removed %s, %d accounts left", name, self.account_count)
+
+    async def relogin_account(self, name: str) -> bool:
+        """Reconnect the session of ``name``, it is removed if that fails."""
+        if (client := self.get_client(name)) is None:
+            raise ValueError(f"{name} is not in the pool")
+        await self._stop_client(client)
+        return await self.ensure_started(client)
+
+    def drain_account(self, name: str, drain: bool = True) -> None:
+        """Keep ``name`` out of new games, it still plays the current ones."""
+        if self.get_client(name) is None:
+            raise ValueError(f"{name} is not in the pool")
+        if drain:
+            self.draining.add(name)
+        else:
+            self.draining.discard(name)
+
+    async def start(self) -> None:
+        self.started_at = time.monotonic()
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+        self.diagnostics.start()
+        await self.load_state()
+        self.state_store.start()
+        cached = self.load_bot_id_cache()
+        self.account_ids = {
+            x.name: cached[x.name] for x in self.client_group if x.name in cached
+        }
+        self.bot_ids.clear()
+        self.bot_ids.update(self.account_ids.values())
+        if self.recorder is not None:
+            # Before any client starts, so it precedes every update. Accounts
+            # not cached yet are recorded when they first get a message.
+            self.recorder.header(self.account_ids, self.listen_to_group)
+            self.recorder.start()
+        if self.coordinator is not None:
+            # Every shard needs to know the bots of the other shards, ids
+            # learned later are published when their client starts
+            bots_key = f"{self.redis_key_suffix}_bots"
+            if self.bot_ids:
+                await self.redis.sadd(bots_key, *self.bot_ids)
+            self.bot_ids.update(int(x) for x in await self.redis.smembers(bots_key))
+            self.coordinator.start()
+            await self.coordinator.publish("bots", ids=list(self.bot_ids))
+
+        # eager: every client now, staged: listeners now and workers in the
+        # background, lazy: listeners now and workers when a game needs them
+        first = (
+            self.client_group
+            if self.startup_mode == "eager"
+            else self.listener_clients()
         )
+        logger.info("Starting %d clients", len(first))
+        await asyncio.gather(*(self.ensure_started(x) for x in first))
+        metrics.STARTUP.set("listening", value=time.monotonic() - self.started_at)
+        logger.info("Listening after %.1fs", time.monotonic() - self.started_at)
+        rest = [x for x in self.client_group if x.name not in self._client_starts]
+        if self.startup_mode == "staged" and rest:
+            self._startup_future = asyncio.create_task(self._start_workers(rest))
 
     async def stop(self) -> None:
+        if self.coordinator is not None:
+            self.coordinator.stop()
+        if self._startup_future is not None:
+            self._startup_future.cancel()
+            self._startup_future = None
         await asyncio.gather(
-            *(self.safe_start_or_stop(x, x.stop()) for x in self.client_group)
+            *(
+                self.safe_start_or_stop(x, x.stop())
+                for x in self.client_group
+                if self.is_started(x)
+            )
         )
-        await self.redis.close()
+        await self.state_store.stop()
+        if self.recorder is not None:
+            self.recorder.stop()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        self.diagnostics.stop()
 
     async def run(self) -> None:
         await self.start()
+        if hasattr(signal, "SIGHUP"):
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGHUP,
+                lambda: asyncio.create_task(self.reload_config_from_signal()),
+            )
         logger.info("Listening game status")
         await pyrogram.idle()
 
-    async def handle_set_target(self, _client: Client, msg: Message) -> None:
-        if len(msg.command) > 1:
-            if msg.command[1] == "h":
-                self.FORCE_TARGET_HUMAN = not self.FORCE_TARGET_HUMAN
-                await msg.reply(f"Set force target human to {self.FORCE_TARGET_HUMAN}")
+    async def reply(
+        self, client: Client, msg: Message, text: str, delete_after: float = 0
+    ) -> None:
+        limiter = self.rate_limiters[client.name]
+        reply_msg = await limiter.call(msg.reply, text)
+        if delete_after:
+            await asyncio.sleep(delete_after)
+            await limiter.call(reply_msg.delete)
+
+    async def handle_rate_limit_command(self, _client: Client, msg: Message) -> None:
+        await self.reply(
+            _client,
+            msg,
+            "\n".join(
+                f"{name}: "
+                + ", ".join(f"{key}={value}" for key, value in limiter.stats().items())
+                for name, limiter in self.rate_limiters.items()
+            ),
+        )
+
+    def run_command_task(
+        self, client: Client, msg: Message, capture: Awaitable[tuple[str, str]]
+    ) -> None:
+        """Reply with the summary of a capture without holding up the handler
+        for as long as the capture runs."""
+
+        async def run() -> None:
+            try:
+                path, summary = await capture
+            except RuntimeError as e:
+                await self.reply(client, msg, str(e))
+                return
+            await self.reply(client, msg, f"{summary}\n{path}" if path else summary)
+
+        task = asyncio.create_task(run())
+        self._command_tasks.add(task)
+        task.add_done_callback(self._command_tasks.discard)
+
+    @staticmethod
+    def command_seconds(msg: Message, default: float) -> float:
+        try:
+            return min(max(float(msg.command[1]), 0), 300)
+        except (IndexError, ValueError):
+            return default
+
+    async def handle_profile_command(self, _client: Client, msg: Message) -> None:
+        self.run_command_task(
+            _client, msg, self.diagnostics.profile(self.command_seconds(msg, 10))
+        )
+
+    async def handle_memory_command(self, _client: Client, msg: Message) -> None:
+        if len(msg.command) > 1 and msg.command[1] == "stop":
+            await self.reply(_client, msg, self.diagnostics.stop_memory())
+            return
+        self.run_command_task(_client, msg, self.diagnostics.memory())
+
+    async def handle_tasks_command(self, _client: Client, msg: Message) -> None:
+        self.run_command_task(
+            _client, msg, self.diagnostics.tasks(self.command_seconds(msg, 0))
+        )
+
+    async def handle_reload_command(self, _client: Client, msg: Message) -> None:
+        try:
+            lines = await self.reload_config()
+        except (ValueError, SyntaxError, configparser.Error) as e:
+            await self.reply(_client, msg, f"Config not reloaded: {e}")
+            return
+        if self.coordinator is not None:
+            await self.coordinator.publish("reload")
+        await self.reply(_client, msg, "\n".join(lines))
+
+    async def handle_workers_command(self, _client: Client, msg: Message) -> None:
+        await self.reply(
+            _client,
+            msg,
+            "\n".join(
+                self.worker_scheduler.stats(self.client_group, self.rate_limiters)
+            ),
+        )
+
+    def describe_accounts(self) -> str:
+        listeners = self.listener_clients()
+        lines = []
+        for client in self.client_group:
+            if self.is_started(client):
+                state = "started"
+            elif client.name in self._client_starts:
+                state = "starting"
+            else:
+                state = "stopped"
+            lines.append(
+                f"{client.name}: {self.account_ids.get(client.name, '?')}, {state}"
+                + (", draining" if client.name in self.draining else "")
+                + (", listener" if client in listeners else "")
+            )
+        return "\n".join(lines) or "No accounts"
+
+    async def handle_account_command(self, _client: Client, msg: Message) -> None:
+        if len(msg.command) < 3:
+            await self.reply(_client, msg, self.describe_accounts())
+            return
+        action, name = msg.command[1], msg.command[2]
+        if name.isdigit():
+            name = f"werewolf{name}"
+        if not re.fullmatch(r"werewolf\d+", name) or action not in (
+            "add",
+            "drain",
+            "undrain",
+            "remove",
+            "relogin",
+        ):
+            await self.reply(
+                _client,
+                msg,
+                "Usage: /account [add|drain|undrain|remove|relogin <N>]",
+                delete_after=5,
+            )
+            return
+        if (
+            int(name[8:]) % self.shard_count != self.shard_index
+            if action == "add"
+            else self.get_client(name) is None and self.coordinator is not None
+        ):
+            await self.coordinator.publish("account", action=action, name=name)
+            await self.reply(_client, msg, f"Sent {action} {name} to its shard")
+            return
+        try:
+            result = await self.apply_account_action(action, name)
+        except ValueError as e:
+            result = str(e)
+        await self.reply(_client, msg, result)
+
+    async def apply_account_action(self, action: str, name: str) -> str:
+        if action == "add":
+            if not os.path.exists(f"{name}.session"):
+                # Starting a session without one would prompt for a login
+                raise ValueError(f"{name}.session not found, log in to it first")
+            return (
+                f"Added {name}"
+                if await self.add_account(name)
+                else f"{name} couldn't start"
+            )
+        if action == "drain" or action == "undrain":
+            self.drain_account(name, action == "drain")
+            return f"{name} {action}ed"
+        if action == "remove":
+            await self.remove_account(name)
+            return f"Removed {name}"
+        return (
+            f"{name} reconnected"
+            if await self.relogin_account(name)
+            else f"{name} couldn't start and was removed"
+        )
+
+    @staticmethod
+    def parse_command(
+        text: Optional[str], username: str, commands: Collection[str]
+    ) -> Optional[list[str]]:
+        """Parse one of ``commands`` the same way as ``filters.command`` with
+        "/" prefix, which also takes the bot username right after the command,
+        with or without "@"."""
+        if not text or not text.startswith("/") or len(text) < 2 or text[1].isspace():
+            return None
+        head = text[1:].split(maxsplit=1)[0]
+        lowered, username = head.lower(), username.lower()
+        if lowered in commands:
+            command = lowered
+        else:
+            for mention in (f"@{username}", username):
+                if (
+                    mention
+                    and lowered.endswith(mention)
+                    and lowered[: -len(mention)] in commands
+                ):
+                    command = lowered[: -len(mention)]
+                    break
+            else:
+                return None
+        # Like filters.command, a single whitespace after the command is eaten
+        arguments = text[len(head) + 2 :]
+        return [command] + [
+            re.sub(r"\\([\"'])", r"\1", match.group(2) or match.group(3) or "")
+            for match in COMMAND_RE.finditer(arguments)
+        ]
+
+    async def handle_listener_message(self, client: Client, msg: Message) -> None:
+        if msg.chat is None:
+            return
+        if msg.chat.id in self._listen_to_set:
+            if msg.from_user is not None and msg.from_user.id == self.WEREWOLF_BOT_ID:
+                if self.recorder is not None:
+                    self.recorder.record(transcript.GROUP, client, msg)
+                handlers = (
+                    [self.handle_normal_resident, self.handle_join_game]
+                    if msg.text
+                    else [self.handle_join_game]
+                )
             else:
-                self.TARGET = msg.command[1]
-                await msg.reply(f"Target set to: {self.TARGET}")
+                msg.command = self.parse_command(
+                    msg.text or msg.caption,
+                    client.me.username or "",
+                    self._group_commands,
+                )
+                if msg.command is None:
+                    return
+                handler, owner_only = self._group_commands[msg.command[0]]
+                if owner_only and (
+                    msg.from_user is None or msg.from_user.id != self.owner
+                ):
+                    return
+                handlers = [handler]
+        elif msg.chat.id == self.owner:
+            msg.command = self.parse_command(
+                msg.text or msg.caption, client.me.username or "", self._owner_commands
+            )
+            if msg.command is None:
+                return
+            handlers = [self._owner_commands[msg.command[0]]]
+        else:
+            return
+        for handler in handlers:
+            try:
+                await handler(client, msg)
+            except ContinuePropagation:
+                continue
+            break
+
+    async def handle_listener_gate(self, client: Client, msg: Message) -> None:
+        if not await self.election.claim(client.name, msg.chat.id, msg.id):
+            raise StopPropagation
+
+    async def handle_set_target(self, _client: Client, msg: Message) -> None:
+        args = msg.command[1:]
+        # A trailing chat id picks the group, every group otherwise
+        if (
+            args
+            and re.fullmatch(r"-\d+", args[-1])
+            and int(args[-1]) in self.game_configs
+        ):
+            chat_ids = [int(args.pop())]
         else:
-            self.TARGET = ""
-            await msg.reply("Target cleared")
+            chat_ids = list(self.game_configs)
+        configs = [self.game_configs[x] for x in chat_ids]
+        where = f" in {chat_ids[0]}" if len(chat_ids) == 1 else ""
+        if args and args[0] == "h":
+            force_human = not all(x.force_human for x in configs)
+            for config in configs:
+                config.force_human = force_human
+            await self.reply(
+                _client, msg, f"Set force target human to {force_human}{where}"
+            )
+        elif args:
+            for config in configs:
+                config.target = args[0].lower()
+            await self.reply(_client, msg, f"Target set to: {args[0]}{where}")
+        else:
+            for config in configs:
+                config.clear_target()
+            await self.reply(_client, msg, f"Target cleared{where}")
+        for chat_id in chat_ids:
+            self.save_target(chat_id)
+        if self.coordinator is not None:
+            await self.coordinator.publish(
+                "target",
+                targets=[
+                    [x, y.target, y.force_human] for x, y in zip(chat_ids, configs)
+                ],
+            )
         raise ContinuePropagation
 
     async def handle_resend_command(self, _client: Client, msg: Message) -> None:
-        obj = await self.redis.get(f"{self.redis_key_suffix}_{msg.chat.id}")
-        if obj is not None:
-            obj = obj.decode()
-        else:
+        obj = await self.state_store.get_join_key(msg.chat.id)
+        if obj is None:
             return
         if len(msg.command) > 1:
             for client in self.client_group:
-                if client.name == msg.command[1]:
-                    await client.send_message(self.WEREWOLF_BOT_ID, f"/start {obj}")
+                if client.name == msg.command[1] and await self.ensure_started(client):
+                    await self.rate_limiters[client.name].call(
+                        client.send_message, self.WEREWOLF_BOT_ID, f"/start {obj}"
+                    )
+                    break
+            else:
+                if self.coordinator is not None:
+                    await self.coordinator.publish(
+                        "resend", name=msg.command[1], link=obj
+                    )
 
     async def handle_toggle_debug_command(self, _client: Client, msg: Message) -> None:
         logger.setLevel(
             logging.INFO if logger.level == logging.DEBUG else logging.DEBUG
         )
-        msg = await msg.reply(
-            f'Set level to {"DEBUG" if logger.level == logging.DEBUG else "INFO"}'
+        await self.reply(
+            _client,
+            msg,
+            f'Set level to {"DEBUG" if logger.level == logging.DEBUG else "INFO"}',
+            delete_after=5,
         )
-        await asyncio.sleep(5)
-        await msg.delete()
 
     async def handle_join_game(self, _client: Client, msg: Message) -> None:
         instance = self.game_configs[msg.chat.id]
-        self.TARGET = ""
-        self.FORCE_TARGET_HUMAN = False
         if (
             msg.reply_markup
             and msg.reply_markup.inline_keyboard
@@ -342,216 +1933,324 @@ class Players:
                 )
             )
         ):
-            obj = await self.redis.get(f"{self.redis_key_suffix}_{msg.chat.id}")
+            async with metrics.STORAGE_LATENCY.time(
+                self.state_store.name, "get_join_key"
+            ):
+                obj = await self.state_store.get_join_key(msg.chat.id)
             if obj is not None:
-                obj = obj.decode()
                 if not instance.enabled:
                     return
             instance.clear_id_cards()
+            self.state_store.clear_id_cards(msg.chat.id)
             link = msg.reply_markup.inline_keyboard[0][0].url.split("=")[1]
             if obj == link:
                 return
-            if instance.group_join_string in self.game_identification_mapping:
-                self.game_identification_mapping.pop(instance.group_join_string)
-            instance.group_join_string = link
-            waiter = asyncio.gather(
-                *(
-                    JoinGameTracker.create(self.client_group[x], link).wait()
-                    for x in range(self.game_configs[msg.chat.id].worker_num)
+            if self.coordinator is not None:
+                await self.coordinator.publish(
+                    "join",
+                    chat_id=msg.chat.id,
+                    link=link,
+                    worker_num=instance.worker_num,
                 )
-            )
+            waiter = self.join_game(msg.chat.id, link, instance.worker_num)
             logger.info("Joined the game %s", link)
-            await self.redis.set(f"{self.redis_key_suffix}_{msg.chat.id}", link)
+            async with metrics.STORAGE_LATENCY.time(
+                self.state_store.name, "set_join_key"
+            ):
+                await self.state_store.set_join_key(msg.chat.id, link)
             await waiter
         raise ContinuePropagation
 
+    def select_workers(self, chat_id: int, worker_num: int) -> list[Client]:
+        clients = [x for x in self.client_group if x.name not in self.draining]
+        if self.shard_count == 1:
+            return self.worker_scheduler.assign(
+                chat_id, clients, worker_num, self.rate_limiters
+            )
+        # Worker slots are numbered across every shard by session index
+        return [x for x in clients if int(x.name[8:]) < worker_num]
+
+    def join_game(self, chat_id: int, link: str, worker_num: int) -> asyncio.Future:
+        instance = self.game_configs[chat_id]
+        # The previous game stays registered, its last prompts may still come
+        self.game_registry.add(chat_id, link)
+        instance.group_join_string = link
+        self.save_game(chat_id)
+        # A target only holds for the game it was set in
+        if instance.clear_target():
+            self.save_target(chat_id)
+        metrics.ACTIVE_GAMES.set(str(chat_id), value=1)
+        if self.first_join_at is None:
+            self.first_join_at = time.monotonic()
+            metrics.STARTUP.set(
+                "first_join", value=self.first_join_at - self.started_at
+            )
+            logger.info(
+                "First join %.1fs after start", self.first_join_at - self.started_at
+            )
+        return asyncio.gather(
+            *(
+                (
+                    self.create_join_tracker(x, link).wait()
+                    if self.is_started(x)
+                    else self.join_when_started(x, link)
+                )
+                for x in self.select_workers(chat_id, worker_num)
+            )
+        )
+
+    def create_join_tracker(self, client: Client, link: str) -> JoinGameTracker:
+        return JoinGameTracker.create(
+            self.routers[client.name],
+            self.rate_limiters[client.name],
+            link,
+            retries=self.join_retries,
+            backoff=self.join_backoff,
+        )
+
+    async def join_when_started(self, client: Client, link: str) -> None:
+        # Jumps the queue of staged startup, a game is waiting for it
+        if await self.ensure_started(client):
+            await self.create_join_tracker(client, link).wait()
+
+    async def handle_shard_event(self, event: dict[str, Any]) -> None:
+        if event["type"] == "join":
+            self.game_configs[event["chat_id"]].clear_id_cards()
+            # Not awaited, the listener must keep receiving events meanwhile
+            self.join_game(event["chat_id"], event["link"], event["worker_num"])
+        elif event["type"] == "target":
+            for chat_id, target, force_human in event["targets"]:
+                if (config := self.game_configs.get(chat_id)) is not None:
+                    config.target, config.force_human = target, force_human
+        elif event["type"] == "id_card":
+            self.game_configs[event["chat_id"]].id_cards.add(event["user_id"])
+        elif event["type"] == "bots":
+            self.bot_ids.update(event["ids"])
+        elif event["type"] == "reload":
+            await self.reload_config_from_signal()
+        elif event["type"] == "game_end":
+            self.worker_scheduler.release(event["chat_id"])
+            self.game_registry.finish(event["chat_id"])
+        elif event["type"] == "account":
+            if (
+                int(event["name"][8:]) % self.shard_count == self.shard_index
+                if event["action"] == "add"
+                else self.get_client(event["name"]) is not None
+            ):
+                try:
+                    logger.info(
+                        "%s",
+                        await self.apply_account_action(event["action"], event["name"]),
+                    )
+                except ValueError as e:
+                    logger.warning("Account %s: %s", event["action"], e)
+        elif event["type"] == "resend":
+            for client in self.client_group:
+                if client.name == event["name"] and await self.ensure_started(client):
+                    await self.rate_limiters[client.name].call(
+                        client.send_message,
+                        self.WEREWOLF_BOT_ID,
+                        f"/start {event['link']}",
+                    )
+
     async def handle_set_num_worker(self, _client: Client, msg: Message) -> None:
         if len(msg.command) > 1:
             try:
                 worker_num = int(msg.command[1])
-                if worker_num > len(self.client_group) or worker_num < 1:
+                if worker_num > self.account_count or worker_num < 1:
                     raise ValueError
                 self.game_configs[msg.chat.id].worker_num = worker_num
+                self.save_game(msg.chat.id)
                 return
             except ValueError:
                 pass
-        msg = await msg.reply("Please check your input")
-        await asyncio.sleep(5)
-        await msg.delete()
+        await self.reply(_client, msg, "Please check your input", delete_after=5)
 
     async def handle_normal_resident(self, _client: Client, msg: Message) -> None:
-        if any(
-            x in msg.text
-            for x in [
-                "和事佬",
-                "銀渣",
-                "哼着",
-                "回到家中哼起",
-                "出示了來自官方",
-                "捣蛋",
-                "一聲槍聲",
-            ]
-        ):
-            logger.debug(repr(msg))
-            instance = self.game_configs[msg.chat.id].id_cards
-            for x in msg.entities:
-                if x.type == "text_mention" and str(x.user.id) not in instance:
-                    logger.debug("Insert %d to HAS_ID_CARD array", x.user.id)
-                    instance.append(str(x.user.id))
+        events = self.event_matcher.match(msg.text)
+        if EventMatcher.ID_CARD in events:
+            logger.debug("%r", msg)
+            config = self.game_configs[msg.chat.id]
+            for x in msg.entities or ():
+                if (
+                    x.type == MessageEntityType.TEXT_MENTION
+                    and x.user.id not in config.id_cards
+                ):
+                    logger.debug("Insert %d to HAS_ID_CARD set", x.user.id)
+                    # Added before the publish awaits, so a repeated mention
+                    # is neither added nor published twice
+                    config.id_cards.add(x.user.id)
+                    self.state_store.add_id_card(msg.chat.id, x.user.id)
+                    if self.coordinator is not None:
+                        await self.coordinator.publish(
+                            "id_card", chat_id=msg.chat.id, user_id=x.user.id
+                        )
+        if EventMatcher.GAME_END in events:
+            logger.debug("Game in %d ended", msg.chat.id)
+            metrics.ACTIVE_GAMES.set(str(msg.chat.id), value=0)
+            self.worker_scheduler.release(msg.chat.id)
+            self.game_registry.finish(msg.chat.id)
+            if self.coordinator is not None:
+                await self.coordinator.publish("game_end", chat_id=msg.chat.id)
+            self.game_configs[msg.chat.id].clear_id_cards()
+            self.state_store.clear_id_cards(msg.chat.id)
         raise ContinuePropagation
 
     async def handle_close_auto_join(self, _client: Client, msg: Message) -> None:
         instance = self.game_configs[msg.chat.id]
         instance.enabled = not instance.enabled
-        if instance.enabled:
-            _msg = await msg.reply("Started")
-        else:
-            _msg = await msg.reply("Stopped")
-        await asyncio.sleep(5)
-        await _msg.delete()
+        self.save_game(msg.chat.id)
+        await self.reply(
+            _client, msg, "Started" if instance.enabled else "Stopped", delete_after=5
+        )
         raise ContinuePropagation
 
+    def resolve_game_identification(self, group_id_str: str) -> Optional[int]:
+        """Map the game id found in callback data to the group it belongs to.
+
+        Runs without awaiting, so concurrent prompts never see a game half
+        resolved and need no lock.
+        """
+        entry, new = self.game_registry.resolve(group_id_str)
+        if entry is None:
+            return None
+        if new:
+            self.state_store.set_identification(group_id_str, entry.chat_id)
+        return entry.chat_id
+
+    def forget_game(self, entry: GameEntry) -> None:
+        if entry.game_id is not None:
+            self.state_store.remove_identification(entry.game_id)
+
     async def handle_werewolf_game(self, client: Client, msg: Message) -> None:
         client_id: str = client.name
+        if self.recorder is not None:
+            self.recorder.record(transcript.PRIVATE, client, msg)
+        arrived_at = time.monotonic()
+        if msg.date is not None:
+            # Count the time the prompt spent in transit against the deadline
+            arrived_at -= min(max(time.time() - msg.date.timestamp(), 0), 10)
         if msg.text:
-            logger.info("%s: %s", client.name, msg.text)
+            logger_game.info("%s: %s", client.name, msg.text)
         if msg.caption:
-            logger.info("%s: %s", client.name, msg.caption)
+            logger_game.info("%s: %s", client.name, msg.caption)
         if isinstance(msg.reply_markup, ReplyKeyboardRemove):
             raise ContinuePropagation
         if not (msg.reply_markup and msg.reply_markup.inline_keyboard):
             raise ContinuePropagation
-        await asyncio.sleep(random.randint(5, 15))
-        async with self.lock:
-            # Get group identification string from inline keyboard callback data
-            group_id_str = msg.reply_markup.inline_keyboard[0][0].callback_data.split(
-                "|"
-            )[2]
-            if not (group_id := self.game_identification_mapping.get(group_id_str)):
-                for group_id, config in self.game_configs.items():
-                    if group_id_str in config.group_join_string:
-                        self.game_identification_mapping.update(
-                            {group_id_str: group_id}
-                        )
-                        config.group_join_string = group_id_str
-                        break
-
-            non_bot_button_loc: list[int] = []
-            menu_length = len(msg.reply_markup.inline_keyboard)
-            for x in range(0, menu_length):
-                if any(
-                    u in msg.reply_markup.inline_keyboard[x][0].callback_data
-                    for u in self.BOT_LIST
-                ):
-                    continue
-                non_bot_button_loc.append(x)
-            _FORCE_HUMAN = (
-                self.FORCE_TARGET_HUMAN
-                or not random.randint(0, 9)
-                or (menu_length < 4 and not random.randint(0, 6))
-            )
-            _HAS_TARGET = not self.FORCE_TARGET_HUMAN and self.TARGET != ""
-            logger.debug(
-                "%s: STATUS FORCE_HUMAN: %s, _HAS_TARGET: %s",
-                client_id,
-                _FORCE_HUMAN,
-                _HAS_TARGET,
-            )
-            if msg.reply_markup:
-                logger_detail.debug("%s", repr(msg.reply_markup))
-            group_id_card_instance = self.game_configs[group_id].id_cards
-            while True:
-                try:
-                    if len(msg.reply_markup.inline_keyboard) < 2:
-                        if not random.randint(0, 3):
-                            await msg.click()
-
-                    fail_check = 0
-                    while True:
-                        final_choose = random.randint(0, menu_length - 1)
-                        logger.debug("%s: random choose: %d", client_id, final_choose)
-                        if (
-                            msg.text
-                            and msg.text.startswith("你想處死誰")
-                            and _FORCE_HUMAN
-                        ):
-                            if len(non_bot_button_loc):
-                                final_choose = random.choice(non_bot_button_loc)
-                                logger.debug(
-                                    "%s: Redirect choose to %d", client_id, final_choose
-                                )
-                        if _HAS_TARGET:
-                            for x in range(0, menu_length):
-                                if (
-                                    self.TARGET
-                                    in msg.reply_markup.inline_keyboard[x][
-                                        0
-                                    ].text.lower()
-                                ):
-                                    logger.debug(
-                                        "Find target %s",
-                                        msg.reply_markup.inline_keyboard[x][
-                                            0
-                                        ].callback_data,
-                                    )
-                                    final_choose = x
-                                    break
-                        elif (
-                            len(group_id_card_instance)
-                            and any(
-                                x
-                                in msg.reply_markup.inline_keyboard[final_choose][
-                                    0
-                                ].callback_data
-                                for x in group_id_card_instance
-                            )
-                            and fail_check < 2
-                        ):
-                            logger.debug(
-                                "%s: Got HAS_ID_CARD target, Try choose target again",
-                                client.name,
-                            )
-
-                            fail_check += 1
-                            continue
-                        logger.debug("%s: final choose: %d", client_id, final_choose)
-                        for retries in range(1, 4):
-                            try:
-                                await msg.click(final_choose)
-                                break
-                            except MessageIdInvalid:
-                                logger.warning(
-                                    "%s: Got MessageIdInvalid (retries: %d)",
-                                    client_id,
-                                    retries,
-                                )
-                        break
-                    # logger.debug(repr(msg))
-                    break
-                except TimeoutError:
-                    pass
+        if not any(row[0].callback_data for row in msg.reply_markup.inline_keyboard):
+            # Only url buttons, nothing to vote
+            raise ContinuePropagation
+        buttons = CallbackData.parse_keyboard(msg.reply_markup)
+        prompt_type = ClickScheduler.classify(msg)
+        # Get group identification string from inline keyboard callback data
+        group_id = None
+        if buttons[0].game_id:
+            group_id = self.resolve_game_identification(buttons[0].game_id)
+        await self.click_scheduler.wait(
+            prompt_type, buttons[0].game_id, arrived_at, group_id
+        )
+        policy, state = self.policy, decision.GroupState(bot_ids=self.bot_ids)
+        if group_id is not None:
+            instance = self.game_configs[group_id]
+            policy = instance.policy or self.policy
+            # Taken after the wait, id cards revealed meanwhile count. Nothing
+            # is awaited between reading the state and deciding, so handlers
+            # of other accounts can't change it halfway and no lock is needed
+            state = instance.decision_state(self.bot_ids)
+        prompt = decision.Prompt.from_buttons(
+            prompt_type,
+            [row[0].text for row in msg.reply_markup.inline_keyboard],
+            [x.target_user_id for x in buttons],
+        )
+        choice = policy.decide(prompt, state)
+        metrics.DECISIONS.inc(policy.name, choice.reason)
+        logger_game.debug(
+            "%s: %s policy chose %d (%s)",
+            client_id,
+            policy.name,
+            choice.index,
+            choice.reason,
+        )
+        logger_detail.debug("%r", msg.reply_markup)
+        # Only the click awaits Telegram, so accounts and games don't queue up
+        # behind each other.
+        for retries in range(1, 4):
+            try:
+                await self.rate_limiters[client_id].call(msg.click, choice.index)
+            except MessageIdInvalid:
+                logger_game.warning(
+                    "%s: Got MessageIdInvalid (retries: %d)", client_id, retries
+                )
+                continue
+            except TimeoutError:
+                continue
+            self.click_scheduler.record(prompt_type, arrived_at, group_id)
+            metrics.PROMPT_TO_CLICK.observe(time.monotonic() - arrived_at, prompt_type)
+            break
 
 
-async def main() -> None:
-    p = await Players.create()
+async def main(shard_index: int = 0, record: Optional[str] = None) -> None:
+    p = await Players.create(shard_index)
+    if record is not None:
+        p.recorder = transcript.Recorder(record)
     await p.run()
     await p.stop()
 
 
-if __name__ == "__main__":
-    try:
-        import coloredlogs
-
-        coloredlogs.install(
-            logging.DEBUG,
-            fmt="%(asctime)s,%(msecs)03d - %(levelname)s - %(funcName)s - %(lineno)d - %(message)s",
+async def supervise(shard_count: int) -> None:
+    """Run every shard in its own process and restart the ones that exit."""
+    args = [x for x in sys.argv[1:] if x in ("--debug", "--detail")]
+    if "--record" in sys.argv:
+        args.extend(
+            sys.argv[sys.argv.index("--record") : sys.argv.index("--record") + 2]
         )
-    except ModuleNotFoundError:
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format="%(asctime)s - %(levelname)s - %(funcName)s - %(lineno)d - %(message)s",
+
+    processes: dict[int, asyncio.subprocess.Process] = {}
+    if hasattr(signal, "SIGHUP"):
+        # Every shard reloads its config on its own
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGHUP,
+            lambda: [
+                x.send_signal(signal.SIGHUP)
+                for x in processes.values()
+                if x.returncode is None
+            ],
         )
 
+    async def run_shard(index: int) -> None:
+        restarts = 0
+        while True:
+            started_at = time.monotonic()
+            process = processes[index] = await asyncio.create_subprocess_exec(
+                sys.executable, __file__, "--shard", str(index), *args
+            )
+            try:
+                code = await process.wait()
+            except asyncio.CancelledError:
+                process.terminate()
+                await process.wait()
+                raise
+            # A shard that ran for a while gets restarted right away again
+            restarts = 0 if time.monotonic() - started_at > 60 else restarts + 1
+            delay = min(2**restarts, 60)
+            logger.error(
+                "Shard %d exited with code %d, restart in %ds", index, code, delay
+            )
+            await asyncio.sleep(delay)
+
+    logger.info("Starting %d shards", shard_count)
+    await asyncio.gather(*(run_shard(x) for x in range(shard_count)))
+
+
+if __name__ == "__main__":
+    _config = ConfigParser()
+    _config.read("config.ini")
+    _shard_index = (
+        int(sys.argv[sys.argv.index("--shard") + 1]) if "--shard" in sys.argv else None
+    )
+    _log_listener = logs.setup(_config, _shard_index)
+
     if "--debug" in sys.argv:
         logger.setLevel(logging.DEBUG)
         logger.info("Program is running under debug mode")
@@ -559,4 +2258,20 @@ if __name__ == "__main__":
         logger_detail.setLevel(logging.DEBUG)
         logger_detail.info("Program will show more detail information")
     logging.getLogger("pyrogram").setLevel(logging.WARNING)
-    asyncio.get_event_loop().run_until_complete(main())
+    _record = (
+        sys.argv[sys.argv.index("--record") + 1] if "--record" in sys.argv else None
+    )
+    try:
+        if _shard_index is not None:
+            asyncio.get_event_loop().run_until_complete(
+                main(
+                    _shard_index,
+                    f"{_record}.{_shard_index}" if _record is not None else None,
+                )
+            )
+        elif (_shard_count := _config.getint("shard", "count", fallback=1)) > 1:
+            asyncio.get_event_loop().run_until_complete(supervise(_shard_count))
+        else:
+            asyncio.get_event_loop().run_until_complete(main(record=_record))
+    finally:
+        _log_listener.stop()
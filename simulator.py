@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# simulator.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Offline stand-in for pyrogram clients and the werewolf bot.
+
+Runs ``Players`` end to end without network and reports join and click
+latency, e.g. ``python simulator.py --groups 4 --accounts 8``, or replays a
+transcript captured with ``player.py --record`` through ``--replay``.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import datetime
+import itertools
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, Optional
+
+from pyrogram import ContinuePropagation, StopPropagation
+from pyrogram.enums import MessageEntityType
+from pyrogram.handlers.handler import Handler
+from pyrogram.types import (
+    Chat,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    Message,
+    MessageEntity,
+    User,
+)
+
+import transcript
+from player import ClickScheduler, DelayWindow, GameConfig, Players
+from storage import MemoryBackend, StateBackend
+
+logger = logging.getLogger("Werewolf_bot").getChild("simulator")
+
+_message_ids = itertools.count(1)
+
+
+class FakeMessage(Message):
+    """A real ``Message`` (filters check its type) whose methods talk to the
+    fake werewolf bot instead of Telegram."""
+
+    def __init__(
+        self,
+        client: Optional[FakeClient],
+        chat_id: int,
+        from_user_id: int,
+        text: Optional[str] = None,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        entities: Optional[list[Any]] = None,
+        message_id: Optional[int] = None,
+        caption: Optional[str] = None,
+        date: Optional[datetime.datetime] = None,
+    ):
+        super().__init__(
+            id=message_id if message_id is not None else next(_message_ids),
+            chat=Chat(id=chat_id),
+            from_user=User(id=from_user_id),
+            text=text,
+            caption=caption,
+            reply_markup=reply_markup,
+            entities=entities,
+            date=date or datetime.datetime.now(),
+            outgoing=False,
+        )
+        self.client = client
+
+    async def click(self, x: int = 0, *_args: Any, **_kwargs: Any) -> None:
+        await self.client.network()
+        button = self.reply_markup.inline_keyboard[x][0]
+        await self.client.bot.handle_callback(self.client, self, button.callback_data)
+
+    async def reply(self, text: str, *_args: Any, **_kwargs: Any) -> FakeMessage:
+        await self.client.network()
+        return FakeMessage(self.client, self.chat.id, self.client.me.id, text)
+
+    async def delete(self, *_args: Any, **_kwargs: Any) -> None:
+        await self.client.network()
+
+
+class FakeClient:
+    """Stand-in for ``pyrogram.Client`` which talks to a ``FakeWerewolfBot``."""
+
+    def __init__(
+        self,
+        name: str,
+        user_id: int,
+        bot: FakeWerewolfBot,
+        latency: float = 0,
+        start_latency: float = 0,
+    ):
+        self.name = name
+        self.me = SimpleNamespace(id=user_id, username=name, first_name=name)
+        self.bot = bot
+        self.latency = latency
+        self.start_latency = start_latency
+        self.handlers: dict[int, list[Handler]] = {}
+        self.sent_messages = 0
+        bot.clients[user_id] = self
+
+    async def network(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    def add_handler(self, handler: Handler, group: int = 0) -> None:
+        self.handlers.setdefault(group, []).append(handler)
+
+    def remove_handler(self, handler: Handler, group: int = 0) -> None:
+        self.handlers[group].remove(handler)
+
+    async def start(self) -> None:
+        await asyncio.sleep(self.start_latency * random.uniform(0.5, 1.5))
+
+    async def stop(self) -> None:
+        pass
+
+    async def get_me(self) -> SimpleNamespace:
+        await self.network()
+        return self.me
+
+    async def send_message(self, chat_id: int, text: str, **_kwargs: Any) -> None:
+        self.sent_messages += 1
+        await self.network()
+        await self.bot.handle_private_message(self, text)
+
+    async def dispatch(self, msg: FakeMessage) -> None:
+        """Run handlers with the same group and propagation rules as pyrogram."""
+        for group in sorted(self.handlers):
+            for handler in list(self.handlers[group]):
+                if not await handler.check(self, msg):
+                    continue
+                try:
+                    await handler.callback(self, msg)
+                except StopPropagation:
+                    return
+                except ContinuePropagation:
+                    continue
+                break
+
+    def receive(self, msg: FakeMessage) -> asyncio.Task:
+        async def deliver() -> None:
+            await self.network()
+            await self.dispatch(msg)
+
+        return asyncio.create_task(deliver())
+
+
+@dataclass
+class FakeGame:
+    chat_id: int
+    game_id: str
+    join_key: str
+    announced_at: float
+    joined: dict[int, float] = field(default_factory=dict)
+
+
+class FakeWerewolfBot:
+    """Emit join announcements, join confirmations and vote prompts."""
+
+    def __init__(self, human_players: int = 4):
+        self.clients: dict[int, FakeClient] = {}
+        self.human_players = human_players
+        self.games: dict[str, FakeGame] = {}
+        self._games_by_key: dict[str, FakeGame] = {}
+        self.already_in_game = 0
+        self.join_latency: list[float] = []
+        self.click_latency: list[float] = []
+        # message id -> (monotonic time the prompt was sent, answered)
+        self._prompts: dict[int, list[Any]] = {}
+
+    def announce(self, chat_id: int, listeners: list[FakeClient]) -> FakeGame:
+        game_id = f"{random.getrandbits(32):08x}"
+        game = FakeGame(chat_id, game_id, f"{chat_id}{game_id}", time.monotonic())
+        self.games[game_id] = game
+        self._games_by_key[game.join_key] = game
+        message_id = next(_message_ids)
+        for client in listeners:
+            client.receive(self.announcement(client, game, message_id))
+        return game
+
+    @staticmethod
+    def announcement(
+        client: FakeClient, game: FakeGame, message_id: Optional[int] = None
+    ) -> FakeMessage:
+        """The group message with the join button of ``game``."""
+        return FakeMessage(
+            client,
+            game.chat_id,
+            Players.WEREWOLF_BOT_ID,
+            "#players: 0",
+            InlineKeyboardMarkup(
+                [
+                    [
+                        InlineKeyboardButton(
+                            "加入遊戲",
+                            url=f"https://t.me/werewolfbot?start={game.join_key}",
+                        )
+                    ]
+                ]
+            ),
+            message_id=message_id,
+        )
+
+    async def handle_private_message(self, client: FakeClient, text: str) -> None:
+        if not text.startswith("/start "):
+            return
+        game = self._games_by_key.get(text[7:])
+        if game is None:
+            return
+        if any(client.me.id in x.joined for x in self.games.values()):
+            # Also when the account plays in a game of another group
+            self.already_in_game += 1
+            reply = "You are already in a game!"
+        else:
+            game.joined[client.me.id] = time.monotonic()
+            self.join_latency.append(time.monotonic() - game.announced_at)
+            reply = "你已加入 Simulated 的遊戲中"
+        client.receive(FakeMessage(client, Players.WEREWOLF_BOT_ID, 0, reply))
+
+    def send_vote_prompts(self, game: FakeGame) -> None:
+        candidates = list(game.joined) + [1000 + x for x in range(self.human_players)]
+        for index, user_id in enumerate(game.joined):
+            client = self.clients[user_id]
+            markup = InlineKeyboardMarkup(
+                [
+                    [
+                        InlineKeyboardButton(
+                            f"Player {target}",
+                            callback_data=f"vote|{index}|{game.game_id}|{target}",
+                        )
+                    ]
+                    for target in candidates
+                    if target != user_id
+                ]
+            )
+            msg = FakeMessage(
+                client, Players.WEREWOLF_BOT_ID, 0, "你想處死誰？", markup
+            )
+            self._prompts[msg.id] = [time.monotonic(), False]
+            client.receive(msg)
+
+    async def handle_callback(
+        self, _client: FakeClient, msg: FakeMessage, _data: str
+    ) -> None:
+        prompt = self._prompts.get(msg.id)
+        if prompt is None or prompt[1]:
+            return
+        prompt[1] = True
+        self.click_latency.append(time.monotonic() - prompt[0])
+
+    @property
+    def pending_prompts(self) -> int:
+        return sum(1 for _sent_at, answered in self._prompts.values() if not answered)
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+async def build_players(
+    bot: FakeWerewolfBot,
+    group_ids: list[int],
+    accounts: dict[str, int],
+    latency: float = 0,
+    delay: tuple[float, float] = (0, 0),
+    listener_mode: str = "single",
+    rate_limit: tuple[int, float] = (5, 1.0),
+    startup: str = "eager",
+    start_latency: float = 0,
+    state_store: Optional[StateBackend] = None,
+) -> Players:
+    players = Players(state_store or MemoryBackend("simulator"))
+    players.listen_to_group = group_ids
+    players.owner = 1
+    players.account_count = len(accounts)
+    players.listener_mode = listener_mode
+    players.rate_limit_burst, players.rate_limit_refill = rate_limit
+    players.startup_mode = startup
+    players.client_group = [
+        FakeClient(name, user_id, bot, latency, start_latency)
+        for name, user_id in accounts.items()
+    ]
+    for group in players.listen_to_group:
+        players.game_configs[group] = GameConfig(True, len(accounts))
+    low, high = delay
+    players.click_scheduler = ClickScheduler(
+        {
+            prompt_type: DelayWindow(low, high, (low + high) / 2, 60)
+            for prompt_type in ClickScheduler.DEFAULT_WINDOWS
+        },
+        safety_margin=0,
+        spread=0,
+    )
+    players.init_message_handler()
+    await players.start()
+    return players
+
+
+async def simulate(
+    groups: int,
+    accounts: int,
+    human_players: int,
+    rounds: int,
+    latency: float,
+    delay: tuple[float, float],
+    listener_mode: str,
+    rate_limit: tuple[int, float] = (5, 1.0),
+    startup: str = "eager",
+    start_latency: float = 0,
+) -> dict[str, float]:
+    bot = FakeWerewolfBot(human_players)
+    players = await build_players(
+        bot,
+        [-1000 - x for x in range(groups)],
+        {f"werewolf{x}": 100 + x for x in range(accounts)},
+        latency,
+        delay,
+        listener_mode,
+        rate_limit,
+        startup,
+        start_latency,
+    )
+    listeners = (
+        players.client_group if listener_mode == "elect" else players.client_group[:1]
+    )
+    # Accounts can only play one game at a time, so split them over the groups
+    worker_num = max(accounts // groups, 1)
+    for config in players.game_configs.values():
+        config.worker_num = worker_num
+    started_at = time.monotonic()
+    clicks = 0
+    for _round in range(rounds):
+        games = [bot.announce(group, listeners) for group in players.listen_to_group]
+        while any(len(game.joined) < worker_num for game in games):
+            await asyncio.sleep(0.001)
+        for game in games:
+            bot.send_vote_prompts(game)
+        clicks += sum(len(game.joined) for game in games)
+        while len(bot.click_latency) < clicks:
+            await asyncio.sleep(0.001)
+        # The next round's announcement is a new game in the same group
+        for game in games:
+            bot.games.pop(game.game_id)
+    elapsed = time.monotonic() - started_at
+    await players.stop()
+    return {
+        "first_join": players.first_join_at - players.started_at,
+        "games": groups * rounds,
+        "clicks": clicks,
+        "elapsed": elapsed,
+        "clicks_per_second": clicks / elapsed if elapsed else 0,
+        "join_p50": percentile(bot.join_latency, 0.5),
+        "join_p99": percentile(bot.join_latency, 0.99),
+        "click_p50": percentile(bot.click_latency, 0.5),
+        "click_p99": percentile(bot.click_latency, 0.99),
+        "already_in_game": bot.already_in_game,
+        "fairness": players.worker_scheduler.fairness(
+            [x.name for x in players.client_group]
+        ),
+    }
+
+
+def decode_message(client: FakeClient, obj: dict[str, Any]) -> FakeMessage:
+    keyboard = obj["keyboard"]
+    return FakeMessage(
+        client,
+        obj["chat_id"],
+        obj["from_user_id"],
+        obj["text"],
+        (
+            InlineKeyboardMarkup(
+                [
+                    [
+                        InlineKeyboardButton(text, callback_data=data, url=url)
+                        for text, data, url in row
+                    ]
+                    for row in keyboard
+                ]
+            )
+            if keyboard
+            else None
+        ),
+        [
+            MessageEntity(
+                type=MessageEntityType[entity_type],
+                offset=offset,
+                length=length,
+                user=User(id=user_id) if user_id is not None else None,
+            )
+            for entity_type, offset, length, user_id in obj["entities"]
+        ],
+        obj["id"],
+        obj["caption"],
+        datetime.datetime.fromtimestamp(obj["date"]) if obj["date"] else None,
+    )
+
+
+async def replay(
+    path: str, speed: float = 0, delay: tuple[float, float] = (0, 0)
+) -> dict[str, float]:
+    """Feed a transcript into ``Players``.
+
+    ``speed`` 1 keeps the original pace, 2 runs twice as fast and 0 feeds
+    every record as soon as possible.
+    """
+    records = list(transcript.read_transcript(path))
+    header = next((x for x in records if x["kind"] == transcript.HEADER), None)
+    if header is None:
+        raise ValueError(f"{path} has no transcript header")
+    accounts = dict(header["accounts"])
+    accounts.update(
+        (x["client"], x["user_id"]) for x in records if x["kind"] == transcript.ACCOUNT
+    )
+    bot = FakeWerewolfBot()
+    players = await build_players(
+        bot, header["groups"], accounts, delay=delay, rate_limit=(1000, 1000)
+    )
+    # The recorded join replies may overtake our join when replaying fast, so
+    # don't wait long for a confirmation the fake bot will never send
+    players.join_retries, players.join_backoff = 0, 0.1
+    clients = {x.name: x for x in players.client_group}
+    handle_latency: list[float] = []
+
+    async def feed(record: dict[str, Any]) -> None:
+        client = clients[record["client"]]
+        msg = decode_message(client, record["message"])
+        started_at = time.monotonic()
+        if record["kind"] == transcript.GROUP:
+            await players.handle_listener_message(client, msg)
+        else:
+            await client.dispatch(msg)
+        handle_latency.append(time.monotonic() - started_at)
+
+    tasks = []
+    started_at = time.monotonic()
+    first_t = records[0]["t"] if records else 0
+    for record in records:
+        if record["kind"] not in (transcript.GROUP, transcript.PRIVATE):
+            continue
+        if (
+            speed
+            and (
+                wait := (record["t"] - first_t) / speed
+                - (time.monotonic() - started_at)
+            )
+            > 0
+        ):
+            await asyncio.sleep(wait)
+        tasks.append(asyncio.create_task(feed(record)))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started_at
+    await players.stop()
+    return {
+        "records": len(tasks),
+        "elapsed": elapsed,
+        "records_per_second": len(tasks) / elapsed if elapsed else 0,
+        "handle_p50": percentile(handle_latency, 0.5),
+        "handle_p99": percentile(handle_latency, 0.99),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--groups", type=int, default=4)
+    parser.add_argument("--accounts", type=int, default=8)
+    parser.add_argument("--players", type=int, default=4, help="human players")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="mean network latency (s)"
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        nargs=2,
+        default=(0, 0),
+        metavar=("LOW", "HIGH"),
+        help="click delay window (s)",
+    )
+    parser.add_argument(
+        "--listener-mode", choices=("single", "elect"), default="single"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        nargs=2,
+        default=("5", "1.0"),
+        metavar=("BURST", "REFILL"),
+        help="per account token bucket",
+    )
+    parser.add_argument(
+        "--startup", choices=("eager", "staged", "lazy"), default="eager"
+    )
+    parser.add_argument(
+        "--start-latency",
+        type=float,
+        default=0.5,
+        help="mean time to start a session (s)",
+    )
+    parser.add_argument("--replay", metavar="PATH", help="replay a transcript")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="replay pace, 1 is the original speed and 0 as fast as possible",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("Werewolf_bot").setLevel(logging.WARNING)
+    if args.replay:
+        result = asyncio.run(replay(args.replay, args.speed, tuple(args.delay)))
+    else:
+        result = asyncio.run(
+            simulate(
+                args.groups,
+                args.accounts,
+                args.players,
+                args.rounds,
+                args.latency,
+                tuple(args.delay),
+                args.listener_mode,
+                (int(args.rate_limit[0]), float(args.rate_limit[1])),
+                args.startup,
+                args.start_latency,
+            )
+        )
+    for key, value in result.items():
+        print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
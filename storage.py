@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# storage.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from configparser import ConfigParser
+from dataclasses import dataclass, field
+from typing import Optional
+
+from redis import asyncio as aioredis
+
+import metrics
+
+logger = logging.getLogger("Werewolf_bot").getChild("storage")
+
+
+@dataclass
+class GameState:
+    enabled: bool = True
+    worker_num: Optional[int] = None
+    group_join_string: str = ""
+    id_cards: set[int] = field(default_factory=set)
+    target: str = ""
+    force_human: bool = False
+
+
+@dataclass
+class StoredState:
+    games: dict[int, GameState] = field(default_factory=dict)
+    # callback data game id -> chat id
+    identification: dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class PendingChanges:
+    games: dict[int, dict[str, str]] = field(default_factory=dict)
+    id_card_adds: dict[int, set[int]] = field(default_factory=dict)
+    id_card_clears: set[int] = field(default_factory=set)
+    identification_sets: dict[str, int] = field(default_factory=dict)
+    identification_dels: set[str] = field(default_factory=set)
+    targets: dict[int, dict[str, str]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(
+            self.games
+            or self.id_card_adds
+            or self.id_card_clears
+            or self.identification_sets
+            or self.identification_dels
+            or self.targets
+        )
+
+    def update(self, newer: PendingChanges) -> None:
+        """Apply the changes of ``newer`` on top of these."""
+        self.games.update(newer.games)
+        for chat_id in newer.id_card_clears:
+            self.id_card_adds.pop(chat_id, None)
+        self.id_card_clears |= newer.id_card_clears
+        for chat_id, user_ids in newer.id_card_adds.items():
+            self.id_card_adds.setdefault(chat_id, set()).update(user_ids)
+        for game_id in newer.identification_dels:
+            self.identification_sets.pop(game_id, None)
+        self.identification_dels -= newer.identification_sets.keys()
+        self.identification_dels |= newer.identification_dels
+        self.identification_sets.update(newer.identification_sets)
+        self.targets.update(newer.targets)
+
+
+class StateBackend(ABC):
+    """Storage of join keys and game state used by ``Players``.
+
+    Join keys are read and written right away since joining depends on them.
+    Every other change is only recorded in memory and written by a
+    background task in one batch, so a burst of changes costs one write.
+    """
+
+    # Label of the storage latency metric
+    name = "base"
+
+    def __init__(self, prefix: str, flush_interval: float = 0.05):
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.round_trips = 0
+        self._pending = PendingChanges()
+        self._dirty = asyncio.Event()
+        self.future: Optional[asyncio.Task] = None
+
+    @abstractmethod
+    async def get_join_key(self, chat_id: int) -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_join_key(self, chat_id: int, key: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def load(self, chat_ids: list[int]) -> StoredState:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _write(self, changes: PendingChanges) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+    def set_game(
+        self, chat_id: int, enabled: bool, worker_num: int, group_join_string: str
+    ) -> None:
+        self._pending.games[chat_id] = {
+            "enabled": "1" if enabled else "0",
+            "worker_num": str(worker_num),
+            "group_join_string": group_join_string,
+        }
+        self._dirty.set()
+
+    def add_id_card(self, chat_id: int, user_id: int) -> None:
+        self._pending.id_card_adds.setdefault(chat_id, set()).add(user_id)
+        self._dirty.set()
+
+    def clear_id_cards(self, chat_id: int) -> None:
+        # A clear supersedes every add queued before it
+        self._pending.id_card_adds.pop(chat_id, None)
+        self._pending.id_card_clears.add(chat_id)
+        self._dirty.set()
+
+    def set_identification(self, game_id: str, chat_id: int) -> None:
+        self._pending.identification_dels.discard(game_id)
+        self._pending.identification_sets[game_id] = chat_id
+        self._dirty.set()
+
+    def remove_identification(self, game_id: str) -> None:
+        self._pending.identification_sets.pop(game_id, None)
+        self._pending.identification_dels.add(game_id)
+        self._dirty.set()
+
+    def set_target(self, chat_id: int, target: str, force_human: bool) -> None:
+        self._pending.targets[chat_id] = {
+            "target": target,
+            "force_human": "1" if force_human else "0",
+        }
+        self._dirty.set()
+
+    async def flush(self) -> None:
+        self._dirty.clear()
+        if not self._pending:
+            return
+        changes, self._pending = self._pending, PendingChanges()
+        try:
+            async with metrics.STORAGE_LATENCY.time(self.name, "write"):
+                await self._write(changes)
+        except BaseException:
+            # Keep the batch for the next flush, under what changed meanwhile
+            changes.update(self._pending)
+            self._pending = changes
+            self._dirty.set()
+            raise
+        self.round_trips += 1
+
+    async def _run(self) -> None:
+        while True:
+            await self._dirty.wait()
+            # Coalesce every change made meanwhile into the same write
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush game state")
+
+    def start(self) -> None:
+        if self.future is None:
+            self.future = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.future is not None:
+            self.future.cancel()
+            self.future = None
+        await self.flush()
+        await self.close()
+
+
+class RedisBackend(StateBackend):
+    """Keep state in redis hashes and sets, changes are written in a pipeline."""
+
+    name = "redis"
+
+    def __init__(
+        self, redis: aioredis.Redis, prefix: str, flush_interval: float = 0.05
+    ):
+        super().__init__(prefix, flush_interval)
+        self.redis = redis
+
+    @classmethod
+    async def from_url(
+        cls, url: str, prefix: str, pool_size: int = 10, flush_interval: float = 0.05
+    ) -> RedisBackend:
+        return cls(
+            await aioredis.from_url(url, max_connections=pool_size),
+            prefix,
+            flush_interval,
+        )
+
+    def _game_key(self, chat_id: int) -> str:
+        return f"{self.prefix}_game_{chat_id}"
+
+    def _id_cards_key(self, chat_id: int) -> str:
+        return f"{self.prefix}_id_cards_{chat_id}"
+
+    @property
+    def _identification_key(self) -> str:
+        return f"{self.prefix}_identification"
+
+    async def get_join_key(self, chat_id: int) -> Optional[str]:
+        obj = await self.redis.get(f"{self.prefix}_{chat_id}")
+        return obj.decode() if obj is not None else None
+
+    async def set_join_key(self, chat_id: int, key: str) -> None:
+        await self.redis.set(f"{self.prefix}_{chat_id}", key)
+
+    async def _write(self, changes: PendingChanges) -> None:
+        pipe = self.redis.pipeline(transaction=False)
+        for chat_id, mapping in changes.games.items():
+            pipe.hset(self._game_key(chat_id), mapping=mapping)
+        for chat_id in changes.id_card_clears:
+            pipe.delete(self._id_cards_key(chat_id))
+        for chat_id, user_ids in changes.id_card_adds.items():
+            pipe.sadd(self._id_cards_key(chat_id), *user_ids)
+        if changes.identification_dels:
+            pipe.hdel(self._identification_key, *changes.identification_dels)
+        if changes.identification_sets:
+            pipe.hset(self._identification_key, mapping=changes.identification_sets)
+        for chat_id, mapping in changes.targets.items():
+            pipe.hset(self._game_key(chat_id), mapping=mapping)
+        await pipe.execute()
+
+    async def load(self, chat_ids: list[int]) -> StoredState:
+        pipe = self.redis.pipeline(transaction=False)
+        for chat_id in chat_ids:
+            pipe.hgetall(self._game_key(chat_id))
+            pipe.smembers(self._id_cards_key(chat_id))
+        pipe.hgetall(self._identification_key)
+        results = await pipe.execute()
+        self.round_trips += 1
+
+        state = StoredState()
+        for index, chat_id in enumerate(chat_ids):
+            game, id_cards = results[index * 2], results[index * 2 + 1]
+            if not game and not id_cards:
+                continue
+            state.games[chat_id] = GameState(
+                game.get(b"enabled", b"1") == b"1",
+                int(game[b"worker_num"]) if b"worker_num" in game else None,
+                game.get(b"group_join_string", b"").decode(),
+                {int(x) for x in id_cards},
+                game.get(b"target", b"").decode(),
+                game.get(b"force_human") == b"1",
+            )
+        state.identification = {
+            key.decode(): int(value) for key, value in results[-1].items()
+        }
+        return state
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+class SQLiteBackend(StateBackend):
+    """Keep state in an embedded SQLite database in WAL mode.
+
+    Queries are local and tiny, so they run directly on the event loop.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, prefix: str, flush_interval: float = 0.05):
+        super().__init__(prefix, flush_interval)
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS join_keys (
+                prefix TEXT, chat_id INTEGER, key TEXT,
+                PRIMARY KEY (prefix, chat_id));
+            CREATE TABLE IF NOT EXISTS games (
+                prefix TEXT, chat_id INTEGER, enabled INTEGER, worker_num INTEGER,
+                group_join_string TEXT, PRIMARY KEY (prefix, chat_id));
+            CREATE TABLE IF NOT EXISTS id_cards (
+                prefix TEXT, chat_id INTEGER, user_id INTEGER,
+                PRIMARY KEY (prefix, chat_id, user_id));
+            CREATE TABLE IF NOT EXISTS identification (
+                prefix TEXT, game_id TEXT, chat_id INTEGER,
+                PRIMARY KEY (prefix, game_id));
+            CREATE TABLE IF NOT EXISTS targets (
+                prefix TEXT, chat_id INTEGER, target TEXT,
+                force_human INTEGER, PRIMARY KEY (prefix, chat_id));
+            """)
+
+    async def get_join_key(self, chat_id: int) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT key FROM join_keys WHERE prefix = ? AND chat_id = ?",
+            (self.prefix, chat_id),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    async def set_join_key(self, chat_id: int, key: str) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO join_keys VALUES (?, ?, ?)",
+            (self.prefix, chat_id, key),
+        )
+
+    async def _write(self, changes: PendingChanges) -> None:
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        self.prefix,
+                        chat_id,
+                        int(game["enabled"]),
+                        int(game["worker_num"]),
+                        game["group_join_string"],
+                    )
+                    for chat_id, game in changes.games.items()
+                ),
+            )
+            self.conn.executemany(
+                "DELETE FROM id_cards WHERE prefix = ? AND chat_id = ?",
+                ((self.prefix, chat_id) for chat_id in changes.id_card_clears),
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO id_cards VALUES (?, ?, ?)",
+                (
+                    (self.prefix, chat_id, user_id)
+                    for chat_id, user_ids in changes.id_card_adds.items()
+                    for user_id in user_ids
+                ),
+            )
+            self.conn.executemany(
+                "DELETE FROM identification WHERE prefix = ? AND game_id = ?",
+                ((self.prefix, game_id) for game_id in changes.identification_dels),
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO identification VALUES (?, ?, ?)",
+                (
+                    (self.prefix, game_id, chat_id)
+                    for game_id, chat_id in changes.identification_sets.items()
+                ),
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO targets VALUES (?, ?, ?, ?)",
+                (
+                    (
+                        self.prefix,
+                        chat_id,
+                        target["target"],
+                        int(target["force_human"]),
+                    )
+                    for chat_id, target in changes.targets.items()
+                ),
+            )
+
+    async def load(self, chat_ids: list[int]) -> StoredState:
+        state = StoredState()
+        wanted = set(chat_ids)
+        for chat_id, enabled, worker_num, group_join_string in self.conn.execute(
+            "SELECT chat_id, enabled, worker_num, group_join_string FROM games "
+            "WHERE prefix = ?",
+            (self.prefix,),
+        ):
+            if chat_id in wanted:
+                state.games[chat_id] = GameState(
+                    bool(enabled), worker_num, group_join_string
+                )
+        for chat_id, user_id in self.conn.execute(
+            "SELECT chat_id, user_id FROM id_cards WHERE prefix = ?", (self.prefix,)
+        ):
+            if chat_id in wanted:
+                state.games.setdefault(chat_id, GameState()).id_cards.add(user_id)
+        state.identification = dict(
+            self.conn.execute(
+                "SELECT game_id, chat_id FROM identification WHERE prefix = ?",
+                (self.prefix,),
+            )
+        )
+        for chat_id, target, force_human in self.conn.execute(
+            "SELECT chat_id, target, force_human FROM targets WHERE prefix = ?",
+            (self.prefix,),
+        ):
+            if chat_id in wanted:
+                game = state.games.setdefault(chat_id, GameState())
+                game.target, game.force_human = target, bool(force_human)
+        self.round_trips += 1
+        return state
+
+    async def close(self) -> None:
+        self.conn.close()
+
+
+class MemoryBackend(StateBackend):
+    """Keep state in process memory.
+
+    When ``path`` is set, state is written behind to a JSON snapshot there by
+    the flush task and read back at startup.
+    """
+
+    name = "memory"
+
+    def __init__(
+        self, prefix: str, path: Optional[str] = None, flush_interval: float = 1
+    ):
+        super().__init__(prefix, flush_interval)
+        self.path = path
+        self.join_keys: dict[int, str] = {}
+        self.state = StoredState()
+        if path is not None and os.path.exists(path):
+            with open(path) as fin:
+                self._from_json(json.load(fin))
+
+    def _from_json(self, obj: dict) -> None:
+        self.join_keys = {int(k): v for k, v in obj.get("join_keys", {}).items()}
+        self.state = StoredState(
+            {
+                int(chat_id): GameState(
+                    game["enabled"],
+                    game["worker_num"],
+                    game["group_join_string"],
+                    set(game["id_cards"]),
+                    game.get("target", ""),
+                    game.get("force_human", False),
+                )
+                for chat_id, game in obj.get("games", {}).items()
+            },
+            obj.get("identification", {}),
+        )
+
+    def _to_json(self) -> dict:
+        return {
+            "join_keys": self.join_keys,
+            "games": {
+                chat_id: {
+                    "enabled": game.enabled,
+                    "worker_num": game.worker_num,
+                    "group_join_string": game.group_join_string,
+                    "id_cards": list(game.id_cards),
+                    "target": game.target,
+                    "force_human": game.force_human,
+                }
+                for chat_id, game in self.state.games.items()
+            },
+            "identification": self.state.identification,
+        }
+
+    async def get_join_key(self, chat_id: int) -> Optional[str]:
+        return self.join_keys.get(chat_id)
+
+    async def set_join_key(self, chat_id: int, key: str) -> None:
+        self.join_keys[chat_id] = key
+        self._dirty.set()
+
+    async def _write(self, changes: PendingChanges) -> None:
+        for chat_id, game in changes.games.items():
+            stored = self.state.games.setdefault(chat_id, GameState())
+            stored.enabled = game["enabled"] == "1"
+            stored.worker_num = int(game["worker_num"])
+            stored.group_join_string = game["group_join_string"]
+        for chat_id in changes.id_card_clears:
+            if chat_id in self.state.games:
+                self.state.games[chat_id].id_cards.clear()
+        for chat_id, user_ids in changes.id_card_adds.items():
+            self.state.games.setdefault(chat_id, GameState()).id_cards.update(user_ids)
+        for game_id in changes.identification_dels:
+            self.state.identification.pop(game_id, None)
+        self.state.identification.update(changes.identification_sets)
+        for chat_id, target in changes.targets.items():
+            stored = self.state.games.setdefault(chat_id, GameState())
+            stored.target = target["target"]
+            stored.force_human = target["force_human"] == "1"
+
+    async def flush(self) -> None:
+        await super().flush()
+        # Join keys are not part of the pending changes, so always dump
+        if self.path is not None:
+            self._dump()
+
+    def _dump(self) -> None:
+        with open(f"{self.path}.tmp", "w") as fout:
+            json.dump(self._to_json(), fout)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    async def load(self, chat_ids: list[int]) -> StoredState:
+        wanted = set(chat_ids)
+        return StoredState(
+            {
+                chat_id: GameState(
+                    game.enabled,
+                    game.worker_num,
+                    game.group_join_string,
+                    set(game.id_cards),
+                    game.target,
+                    game.force_human,
+                )
+                for chat_id, game in self.state.games.items()
+                if chat_id in wanted
+            },
+            dict(self.state.identification),
+        )
+
+
+async def create_backend(config: ConfigParser, prefix: str) -> StateBackend:
+    backend = config.get("storage", "backend", fallback="redis")
+    flush_interval = config.getfloat("storage", "flush_interval", fallback=0.05)
+    if backend == "redis":
+        return await RedisBackend.from_url(
+            config.get("storage", "redis_url", fallback="redis://localhost"),
+            prefix,
+            config.getint("storage", "pool_size", fallback=10),
+            flush_interval,
+        )
+    if backend == "sqlite":
+        return SQLiteBackend(
+            config.get("storage", "sqlite_path", fallback="werewolf.db"),
+            prefix,
+            flush_interval,
+        )
+    if backend == "memory":
+        return MemoryBackend(
+            prefix,
+            config.get("storage", "memory_path", fallback="") or None,
+            flush_interval,
+        )
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# test_commands.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Players.parse_command must agree with pyrogram's filters.command."""
+
+import asyncio
+import itertools
+from types import SimpleNamespace
+from typing import Optional
+
+import pytest
+from pyrogram import filters
+
+from player import Players
+from simulator import FakeMessage
+
+GROUP_COMMANDS = ["resend", "off", "setw"]
+OWNER_COMMANDS = [
+    "target",
+    "debug",
+    "ratelimit",
+    "account",
+    "workers",
+    "profile",
+    "mem",
+    "tasks",
+    "reload",
+]
+USERNAMES = ["WerewolfHelperBot", ""]
+
+CORPUS = [
+    "",
+    "/",
+    "//",
+    "resend",
+    " /resend",
+    "/resend",
+    "/resend ",
+    "/resend  ",
+    "/resend x",
+    "/resend  x",
+    "/resend\tx",
+    "/resend\nx y",
+    "/resend　x",
+    "/ resend x",
+    "/\tresend",
+    "/RESEND x",
+    "/ReSend X Y",
+    "/resendx",
+    "/resend_x",
+    "/resendbob x",
+    "/resend@",
+    "/resend@ x",
+    "/resend@WerewolfHelperBot x",
+    "/resend@werewolfhelperbot",
+    "/resendWerewolfHelperBot x",
+    "/resend@OtherBot x",
+    "/resend@WerewolfHelperBotx",
+    "/resend@WerewolfHelperBot@WerewolfHelperBot",
+    '/resend "two words" x',
+    "/resend 'two words' x",
+    '/resend "unterminated x',
+    '/resend say \\"hi\\"',
+    '/resend ""',
+    "/off",
+    "/offline",
+    "/setw 3",
+    "/setw -3 extra",
+    "/target Alice",
+    "/target h -1001234567890",
+    "/target",
+    "/TARGET bob",
+    "/targetbob",
+    "/debug",
+    "/ratelimit",
+    "/account drain 3",
+    "/account add werewolf12",
+    "/workers",
+    "/profile 5",
+    "/mem",
+    "/mem stop",
+    "/tasks 2",
+    "/reload",
+    "/start abc",
+    "/目標 x",
+    "/target 狼人",
+    "!target x",
+    "text /target x",
+]
+
+
+async def expected(text: str, username: str, commands: list[str]) -> Optional[list]:
+    client = SimpleNamespace(me=SimpleNamespace(username=username))
+    # One filter per command, like the handlers parse_command replaced
+    for command in commands:
+        msg = FakeMessage(None, -1, 1, text or None)
+        if await filters.command(command)(client, msg):
+            return msg.command
+    return None
+
+
+@pytest.mark.parametrize(
+    "commands,username",
+    list(itertools.product([GROUP_COMMANDS, OWNER_COMMANDS], USERNAMES)),
+)
+def test_same_as_filters_command(commands: list[str], username: str):
+    for text in CORPUS:
+        assert Players.parse_command(text, username, set(commands)) == asyncio.run(
+            expected(text, username, commands)
+        ), text
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# test_concurrency.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Prompt to click latency must not grow with the number of accounts."""
+
+import asyncio
+
+import pytest
+
+from simulator import simulate
+
+GROUPS = 2
+LATENCY = 0.02
+
+
+def click_latency(accounts: int) -> dict[str, float]:
+    return asyncio.run(
+        simulate(
+            GROUPS,
+            accounts,
+            human_players=4,
+            rounds=2,
+            latency=LATENCY,
+            delay=(0, 0),
+            listener_mode="single",
+        )
+    )
+
+
+@pytest.mark.parametrize("accounts", [8, 32])
+def test_click_latency_flat_in_account_count(accounts: int):
+    few = click_latency(GROUPS)
+    many = click_latency(accounts)
+    assert many["clicks"] == accounts * 2
+    # Clicks serialized across accounts would take about accounts / GROUPS
+    # round trips for the last one, independent clicks take one
+    assert many["click_p99"] < few["click_p99"] * 2 + 2 * LATENCY
+    assert many["click_p99"] < accounts / GROUPS * LATENCY
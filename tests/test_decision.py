@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# test_decision.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Decisions of the policies, with seeded randomness."""
+
+import random
+
+import pytest
+
+from decision import (
+    HUMAN,
+    LYNCH,
+    NIGHT,
+    ONLY,
+    POLICIES,
+    RANDOM,
+    SINGLE,
+    TARGET,
+    DefaultPolicy,
+    GroupState,
+    HumanPolicy,
+    Prompt,
+    create_policy,
+)
+from player import GameConfig
+
+# Users 1 to 6, 5 and 6 are our accounts, 7 is a skip button
+TARGETS = [1, 2, 3, 4, 5, 6, None]
+BOT_IDS = {5, 6}
+ROUNDS = 500
+
+
+def prompt(kind: str = LYNCH) -> Prompt:
+    return Prompt.from_buttons(
+        kind, [f"Player {x}" if x else "Skip" for x in TARGETS], TARGETS
+    )
+
+
+def votes(policy_name: str, prompt: Prompt, state: GroupState) -> set:
+    policy = create_policy(policy_name, random.Random(0))
+    return {prompt.targets[policy.decide(prompt, state).index] for _ in range(ROUNDS)}
+
+
+@pytest.mark.parametrize("name", POLICIES)
+@pytest.mark.parametrize("kind", [LYNCH, NIGHT])
+def test_avoids_id_card_holders(name, kind):
+    state = GroupState(id_cards={1, 2, 3}, bot_ids=BOT_IDS)
+    voted = votes(name, prompt(kind), state)
+    assert voted
+    assert not voted & state.id_cards
+
+
+@pytest.mark.parametrize("name", POLICIES)
+def test_id_card_holder_when_nobody_else(name):
+    only_holders = Prompt.from_buttons(LYNCH, ["Player 1", "Player 2"], [1, 2])
+    state = GroupState(id_cards={1, 2}, bot_ids=BOT_IDS)
+    assert votes(name, only_holders, state) == {1, 2}
+
+
+@pytest.mark.parametrize("name", POLICIES)
+@pytest.mark.parametrize("kind", [LYNCH, NIGHT])
+def test_target_is_case_insensitive(name, kind):
+    policy = create_policy(name, random.Random(0))
+    for target in ["PLAYER 3", "player 3", "Layer 3"]:
+        decision = policy.decide(prompt(kind), GroupState(target, bot_ids=BOT_IDS))
+        assert (decision.index, decision.reason) == (2, TARGET)
+
+
+@pytest.mark.parametrize("name", POLICIES)
+def test_target_wins_over_id_card(name):
+    # The owner asked for it, even on an id card holder or one of ours
+    policy = create_policy(name, random.Random(0))
+    state = GroupState("player 5", id_cards={5}, bot_ids=BOT_IDS)
+    assert policy.decide(prompt(), state).index == 4
+
+
+@pytest.mark.parametrize("name", POLICIES)
+def test_missing_target_falls_back(name):
+    policy = create_policy(name, random.Random(0))
+    decision = policy.decide(prompt(), GroupState("nobody", bot_ids=BOT_IDS))
+    assert decision.reason in (HUMAN, RANDOM)
+
+
+def test_force_human_overrides_target():
+    config = GameConfig(True, 3)
+    config.target = "player 5"
+    config.force_human = True
+    state = config.decision_state(BOT_IDS)
+    assert (state.target, state.force_human) == ("", True)
+    voted = votes(DefaultPolicy.name, prompt(), state)
+    assert voted == {1, 2, 3, 4}
+
+
+def test_force_human_override_of_group():
+    config = GameConfig(True, 3)
+    config.target = "player 5"
+    config.force_human_override = True
+    # The group always votes for humans, an owner target still counts
+    state = config.decision_state(BOT_IDS)
+    assert (state.target, state.force_human) == ("player 5", True)
+
+
+@pytest.mark.parametrize("kind", [LYNCH, NIGHT])
+def test_human_policy_only_votes_humans(kind):
+    state = GroupState(bot_ids=BOT_IDS)
+    assert votes(HumanPolicy.name, prompt(kind), state) == {1, 2, 3, 4}
+
+
+def test_default_policy_human_only_on_lynch():
+    policy = DefaultPolicy(random.Random(0))
+    state = GroupState(bot_ids=BOT_IDS)
+    lynch = [policy.decide(prompt(LYNCH), state) for _ in range(ROUNDS)]
+    night = [policy.decide(prompt(NIGHT), state) for _ in range(ROUNDS)]
+    # Now and then only humans on lynch votes, never at night
+    assert {x.reason for x in lynch} == {HUMAN, RANDOM}
+    assert {x.reason for x in night} == {RANDOM}
+    assert {TARGETS[x.index] for x in lynch if x.reason == HUMAN} <= {1, 2, 3, 4}
+    # Bots and skip stay possible on random votes
+    assert {TARGETS[x.index] for x in lynch} >= BOT_IDS
+
+
+def test_default_policy_forced_human():
+    state = GroupState(force_human=True, bot_ids=BOT_IDS)
+    policy = DefaultPolicy(random.Random(0))
+    lynch = {policy.decide(prompt(LYNCH), state) for _ in range(ROUNDS)}
+    assert {x.reason for x in lynch} == {HUMAN}
+    assert {TARGETS[x.index] for x in lynch} == {1, 2, 3, 4}
+
+
+def test_human_only_falls_back_without_humans():
+    state = GroupState(force_human=True, bot_ids={1, 2})
+    only_bots = Prompt.from_buttons(LYNCH, ["Player 1", "Player 2"], [1, 2])
+    assert votes(DefaultPolicy.name, only_bots, state) == {1, 2}
+
+
+@pytest.mark.parametrize("name", POLICIES)
+@pytest.mark.parametrize("kind", [LYNCH, NIGHT, SINGLE])
+def test_single_button(name, kind):
+    policy = create_policy(name, random.Random(0))
+    single = Prompt.from_buttons(kind, ["Player 1"], [1])
+    state = GroupState("player 2", force_human=True, id_cards={1}, bot_ids={1})
+    assert policy.decide(single, state).index == 0
+    assert policy.decide(single, state).reason == ONLY
+
+
+def test_seeded_policies_repeat():
+    state = GroupState(bot_ids=BOT_IDS)
+    first, second = DefaultPolicy(random.Random(7)), DefaultPolicy(random.Random(7))
+    assert [first.decide(prompt(), state) for _ in range(50)] == [
+        second.decide(prompt(), state) for _ in range(50)
+    ]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        create_policy("nope")
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# test_game_registry.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Expiry of the games in GameRegistry."""
+
+import time
+
+import pytest
+
+from player import GameRegistry
+
+CHAT_ID = -1000
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_resolve_keeps_finish_grace(clock):
+    registry = GameRegistry(ttl=3600, finish_grace=60)
+    entry = registry.add(CHAT_ID, f"{CHAT_ID}abcd")
+    assert registry.resolve("abcd") == (entry, True)
+    registry.finish(CHAT_ID)
+    assert entry.expires_at == clock[0] + 60
+    clock[0] += 30
+    # A late prompt of the finished game still resolves, without a new TTL
+    assert registry.resolve("abcd") == (entry, False)
+    assert entry.expires_at == clock[0] + 30
+    clock[0] += 31
+    assert registry.resolve("abcd") == (None, False)
+    assert len(registry) == 0
+
+
+def test_finish_picks_latest_joined_game(clock):
+    registry = GameRegistry(ttl=3600, finish_grace=60)
+    previous = registry.add(CHAT_ID, f"{CHAT_ID}aaaa")
+    registry.resolve("aaaa")
+    current = registry.add(CHAT_ID, f"{CHAT_ID}bbbb")
+    registry.resolve("bbbb")
+    # A late prompt of the previous game makes it the most recently used
+    registry.resolve("aaaa")
+    registry.finish(CHAT_ID)
+    assert current.finished and not previous.finished
+    assert current.expires_at == clock[0] + 60
+    assert previous.expires_at == clock[0] + 3600
+
+
+def test_finish_twice_keeps_grace(clock):
+    registry = GameRegistry(ttl=3600, finish_grace=60)
+    entry = registry.add(CHAT_ID, f"{CHAT_ID}abcd")
+    registry.finish(CHAT_ID)
+    clock[0] += 50
+    registry.finish(CHAT_ID)
+    assert entry.expires_at == clock[0] + 10
+
+
+def test_finish_only_its_group(clock):
+    registry = GameRegistry(ttl=3600, finish_grace=60)
+    entry = registry.add(CHAT_ID, f"{CHAT_ID}abcd")
+    registry.finish(CHAT_ID - 1)
+    assert not entry.finished
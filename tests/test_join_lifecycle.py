@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# test_join_lifecycle.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Join trackers must leave nothing behind, whatever way a join ends."""
+
+import asyncio
+import time
+
+from player import JoinGameTracker, RateLimiter, ReplyRouter
+from simulator import FakeClient, FakeGame, FakeWerewolfBot
+
+GAMES = 3000
+BATCH = 30
+
+
+async def run_games() -> None:
+    bot = FakeWerewolfBot()
+    client = FakeClient("werewolf0", 100, bot)
+    router = ReplyRouter(client)
+    limiter = RateLimiter(client.name, burst=GAMES * 2, refill_rate=GAMES)
+    for start in range(0, GAMES, BATCH):
+        trackers = []
+        for index in range(start, start + BATCH):
+            key = f"-1000{index:08x}"
+            if index % 3 != 2:
+                # Joined, or already in a game since one account plays one
+                # game at a time
+                game = FakeGame(-1000, f"{index:08x}", key, time.monotonic())
+                bot.games[game.game_id] = game
+                bot._games_by_key[key] = game
+            # Keys of the third kind never get a reply and time out
+            tracker = JoinGameTracker.create(
+                router, limiter, key, retries=2, backoff=0.005
+            )
+            if index % 5 == 4:
+                tracker.cancel()
+            trackers.append(tracker)
+        await asyncio.gather(*(x.wait() for x in trackers if x.future is not None))
+        # Let replies still in flight reach the router
+        while len(asyncio.all_tasks()) > 1:
+            await asyncio.sleep(0)
+        assert not router.waiters
+        assert client.handlers == {-1: [router.handler]}
+        bot.games.clear()
+        bot._games_by_key.clear()
+    router.close()
+    assert not router.waiters
+    assert not any(client.handlers.values())
+    assert asyncio.all_tasks() == {asyncio.current_task()}
+
+
+def test_join_trackers_leave_nothing_behind():
+    asyncio.run(run_games())
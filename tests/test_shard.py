@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# test_shard.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Shards keep receiving events when the redis connection drops."""
+
+import asyncio
+import json
+
+import pytest
+from redis import asyncio as aioredis
+
+from player import Players, ShardCoordinator
+from storage import RedisBackend
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class FlakyPubSub:
+    """Raises ``error`` after subscribing, ``failures`` times in all."""
+
+    def __init__(self, pubsub, failures: list[int], error: Exception):
+        self.pubsub = pubsub
+        self.failures = failures
+        self.error = error
+
+    async def subscribe(self, channel: str) -> None:
+        await self.pubsub.subscribe(channel)
+
+    async def listen(self):
+        if self.failures[0]:
+            self.failures[0] -= 1
+            raise self.error
+        async for message in self.pubsub.listen():
+            yield message
+
+    async def aclose(self) -> None:
+        await self.pubsub.aclose()
+
+
+async def run_shard(
+    failures: int, error: Exception, malformed: tuple[str, ...] = ()
+) -> tuple[set[int], int]:
+    server = fakeredis.FakeServer()
+    redis = fakeredis.FakeAsyncRedis(server=server)
+    players = Players(RedisBackend(redis, "test"), shard_index=1, shard_count=2)
+    remaining = [failures]
+    pubsub = redis.pubsub
+    redis.pubsub = lambda: FlakyPubSub(pubsub(), remaining, error)
+    coordinator = ShardCoordinator(players, "events")
+    coordinator.RECONNECT_DELAY = 0.01
+    coordinator.start()
+    publisher = fakeredis.FakeAsyncRedis(server=server)
+    # Events published while reconnecting are lost, so repeat until one
+    # goes through
+    for _ in range(200):
+        if players.bot_ids:
+            break
+        for data in malformed:
+            await publisher.publish("events", data)
+        await publisher.publish(
+            "events", json.dumps({"type": "bots", "shard": 0, "ids": [42]})
+        )
+        await asyncio.sleep(0.01)
+    coordinator.stop()
+    return players.bot_ids, coordinator.reconnects
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        aioredis.ConnectionError("Connection closed by server."),
+        aioredis.ResponseError("LOADING Redis is loading the dataset in memory"),
+        OSError("Network is unreachable"),
+    ],
+)
+def test_resubscribes_after_redis_errors(error):
+    bot_ids, reconnects = asyncio.run(run_shard(3, error))
+    assert reconnects == 3
+    assert bot_ids == {42}
+
+
+def test_ignores_malformed_events():
+    malformed = (
+        "not json",
+        "[1, 2]",
+        json.dumps({"type": "bots", "ids": [1]}),
+        json.dumps({"type": "bots", "shard": "0", "ids": [2]}),
+        b"\xff\xfe",
+    )
+    bot_ids, reconnects = asyncio.run(run_shard(0, OSError(), malformed))
+    assert reconnects == 0
+    assert bot_ids == {42}
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# test_storage.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""One suite run against every state storage backend."""
+
+import asyncio
+import os
+from typing import Callable
+
+import pytest
+
+from storage import MemoryBackend, RedisBackend, SQLiteBackend, StateBackend
+
+PREFIX = "test"
+
+
+@pytest.fixture(params=["redis", "sqlite", "memory"])
+def open_backend(request, tmp_path) -> Callable[[], StateBackend]:
+    """Opens the same backend again on every call, like a restart."""
+    if request.param == "redis":
+        fakeredis = pytest.importorskip("fakeredis")
+        server = fakeredis.FakeServer()
+        return lambda: RedisBackend(fakeredis.FakeAsyncRedis(server=server), PREFIX)
+    if request.param == "sqlite":
+        path = os.path.join(tmp_path, "werewolf.db")
+        return lambda: SQLiteBackend(path, PREFIX)
+    path = os.path.join(tmp_path, "werewolf.json")
+    return lambda: MemoryBackend(PREFIX, path)
+
+
+def run(coroutine) -> None:
+    asyncio.run(coroutine)
+
+
+def test_join_key(open_backend):
+    async def main():
+        backend = open_backend()
+        assert await backend.get_join_key(-1) is None
+        await backend.set_join_key(-1, "abc")
+        await backend.set_join_key(-1, "def")
+        assert await backend.get_join_key(-1) == "def"
+        await backend.stop()
+        backend = open_backend()
+        assert await backend.get_join_key(-1) == "def"
+        await backend.stop()
+
+    run(main())
+
+
+def test_round_trip(open_backend):
+    async def main():
+        backend = open_backend()
+        backend.set_game(-1, False, 3, "key1")
+        backend.set_game(-2, True, 5, "")
+        backend.add_id_card(-1, 10)
+        backend.add_id_card(-1, 11)
+        backend.set_identification("game1", -1)
+        backend.set_identification("game2", -2)
+        backend.set_target(-1, "bob", False)
+        backend.set_target(-2, "", True)
+        round_trips = backend.round_trips
+        await backend.flush()
+        # Every change of the batch goes out in one write
+        assert backend.round_trips == round_trips + 1
+        await backend.stop()
+
+        backend = open_backend()
+        state = await backend.load([-1, -2])
+        first, second = state.games[-1], state.games[-2]
+        assert (first.enabled, first.worker_num, first.group_join_string) == (
+            False,
+            3,
+            "key1",
+        )
+        assert first.id_cards == {10, 11}
+        assert (first.target, first.force_human) == ("bob", False)
+        assert (second.enabled, second.worker_num) == (True, 5)
+        assert second.id_cards == set()
+        assert (second.target, second.force_human) == ("", True)
+        assert state.identification == {"game1": -1, "game2": -2}
+        await backend.stop()
+
+    run(main())
+
+
+def test_load_only_wanted_groups(open_backend):
+    async def main():
+        backend = open_backend()
+        backend.set_game(-1, True, 1, "")
+        backend.set_game(-2, True, 2, "")
+        backend.add_id_card(-2, 10)
+        backend.set_target(-2, "bob", False)
+        await backend.flush()
+        state = await backend.load([-1])
+        assert list(state.games) == [-1]
+        await backend.stop()
+
+    run(main())
+
+
+def test_later_changes_win(open_backend):
+    async def main():
+        backend = open_backend()
+        backend.set_game(-1, True, 1, "key1")
+        backend.add_id_card(-1, 10)
+        backend.set_identification("game1", -1)
+        backend.set_target(-1, "bob", True)
+        await backend.flush()
+
+        backend.add_id_card(-1, 11)
+        # A clear drops the adds queued before it, not the ones after
+        backend.clear_id_cards(-1)
+        backend.add_id_card(-1, 12)
+        backend.set_game(-1, True, 2, "key2")
+        backend.remove_identification("game1")
+        backend.set_identification("game2", -1)
+        backend.set_target(-1, "", False)
+        await backend.flush()
+
+        state = await backend.load([-1])
+        game = state.games[-1]
+        assert (game.worker_num, game.group_join_string) == (2, "key2")
+        assert game.id_cards == {12}
+        assert (game.target, game.force_human) == ("", False)
+        assert state.identification == {"game2": -1}
+        await backend.stop()
+
+    run(main())
+
+
+def test_flush_without_changes(open_backend):
+    async def main():
+        backend = open_backend()
+        await backend.flush()
+        assert backend.round_trips == 0
+        assert (await backend.load([-1])).games == {}
+        await backend.stop()
+
+    run(main())
+
+
+def test_background_flush(open_backend):
+    async def main():
+        backend = open_backend()
+        backend.flush_interval = 0.01
+        backend.start()
+        for user_id in range(20):
+            backend.add_id_card(-1, user_id)
+        await asyncio.sleep(0.1)
+        # The burst was coalesced into a single write
+        assert backend.round_trips == 1
+        assert (await backend.load([-1])).games[-1].id_cards == set(range(20))
+        await backend.stop()
+
+    run(main())
+
+
+def test_failed_write_is_retried(open_backend):
+    async def main():
+        backend = open_backend()
+        write = backend._write
+        failures = [ConnectionError("redis went away")]
+
+        async def flaky_write(changes):
+            if failures:
+                raise failures.pop()
+            await write(changes)
+
+        backend._write = flaky_write
+        backend.set_game(-1, True, 3, "key1")
+        backend.add_id_card(-1, 10)
+        backend.set_identification("game1", -1)
+        backend.set_identification("game2", -1)
+        backend.set_target(-1, "bob", False)
+        with pytest.raises(ConnectionError):
+            await backend.flush()
+        assert backend.round_trips == 0
+
+        # Changes made before the retry win over the failed batch
+        backend.add_id_card(-1, 11)
+        backend.set_game(-1, True, 4, "key1")
+        backend.remove_identification("game2")
+        await backend.flush()
+
+        state = await backend.load([-1])
+        game = state.games[-1]
+        assert (game.worker_num, game.group_join_string) == (4, "key1")
+        assert game.id_cards == {10, 11}
+        assert (game.target, game.force_human) == ("bob", False)
+        assert state.identification == {"game1": -1}
+        await backend.stop()
+
+    run(main())
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# test_transcript.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""A transcript recorded by Players replays through the simulator."""
+
+import asyncio
+import os
+
+import pytest
+
+import transcript
+from player import Players
+from simulator import replay, simulate
+
+
+@pytest.mark.parametrize("startup", ["eager", "staged", "lazy"])
+def test_record_and_replay(startup: str, tmp_path, monkeypatch):
+    path = os.path.join(tmp_path, "transcript.jsonl.gz")
+    start = Players.start
+
+    async def recording_start(self: Players) -> None:
+        self.recorder = transcript.Recorder(path, 0.05)
+        await start(self)
+
+    monkeypatch.setattr(Players, "start", recording_start)
+    asyncio.run(
+        simulate(
+            2,
+            4,
+            human_players=4,
+            rounds=2,
+            latency=0.005,
+            delay=(0, 0),
+            listener_mode="single",
+            startup=startup,
+            start_latency=0.01,
+        )
+    )
+    monkeypatch.setattr(Players, "start", start)
+
+    records = list(transcript.read_transcript(path))
+    assert records[0]["kind"] == transcript.HEADER
+    # Without a bot id cache the header knows no account, each one is
+    # written before its first message
+    seen = set(records[0]["accounts"])
+    for record in records[1:]:
+        if record["kind"] == transcript.ACCOUNT:
+            seen.add(record["client"])
+        elif record["kind"] in (transcript.GROUP, transcript.PRIVATE):
+            assert record["client"] in seen
+    messages = sum(x["kind"] in (transcript.GROUP, transcript.PRIVATE) for x in records)
+    assert asyncio.run(replay(path))["records"] == messages
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# transcript.py
+# Copyright (C) 2020-2021 KunoiSayami
+#
+# This module is part of Werewolf-player-bot and is released under
+# the AGPL v3 License: https://www.gnu.org/licenses/agpl-3.0.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""Capture of the messages the werewolf bot sends us.
+
+A transcript is a gzip file of JSON lines, each flush appends a new gzip
+member, so the file is append-only and readable while it is written. Only
+the fields the bot logic reads are kept, never whole pyrogram objects.
+"""
+
+from __future__ import annotations
+import asyncio
+import gzip
+import json
+import logging
+import time
+from typing import Any, Iterator, Optional
+
+from pyrogram import Client
+from pyrogram.types import Message
+
+logger = logging.getLogger("Werewolf_bot").getChild("transcript")
+
+HEADER = "header"
+# First message of an account missing from the header, with its user id
+ACCOUNT = "account"
+# Werewolf bot posts in monitored groups, seen by handle_normal_resident and
+# handle_join_game
+GROUP = "group"
+# Werewolf bot private messages, seen by handle_werewolf_game
+PRIVATE = "private"
+
+
+def encode_message(msg: Message) -> dict[str, Any]:
+    return {
+        "id": msg.id,
+        "chat_id": msg.chat.id,
+        "from_user_id": msg.from_user.id if msg.from_user else None,
+        "text": msg.text,
+        "caption": msg.caption,
+        "date": msg.date.timestamp() if msg.date else None,
+        "entities": [
+            [x.type.name, x.offset, x.length, x.user.id if x.user else None]
+            for x in msg.entities or ()
+        ],
+        "keyboard": (
+            [
+                [[x.text, x.callback_data, x.url] for x in row]
+                for row in msg.reply_markup.inline_keyboard
+            ]
+            if getattr(msg.reply_markup, "inline_keyboard", None)
+            else None
+        ),
+    }
+
+
+class Recorder:
+    """Buffer records and append them to ``path`` once per ``flush_interval``."""
+
+    def __init__(self, path: str, flush_interval: float = 1):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.records = 0
+        # session name -> user id of every account written so far
+        self.accounts: dict[str, int] = {}
+        self._buffer: list[str] = []
+        self.future: Optional[asyncio.Task] = None
+
+    def write(self, kind: str, **kwargs: Any) -> None:
+        self._buffer.append(
+            json.dumps({"kind": kind, "t": time.time(), **kwargs}, ensure_ascii=False)
+        )
+        self.records += 1
+
+    def header(self, accounts: dict[str, int], groups: list[int]) -> None:
+        self.accounts.update(accounts)
+        self.write(HEADER, accounts=accounts, groups=groups)
+
+    def record(self, kind: str, client: Client, msg: Message) -> None:
+        if client.name not in self.accounts:
+            self.accounts[client.name] = client.me.id
+            self.write(ACCOUNT, client=client.name, user_id=client.me.id)
+        self.write(kind, client=client.name, message=encode_message(msg))
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        with gzip.open(self.path, "at", encoding="utf-8") as fout:
+            fout.write("\n".join(lines) + "\n")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Failed to write transcript %s", self.path)
+
+    def start(self) -> None:
+        if self.future is None:
+            self.future = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self.future is not None:
+            self.future.cancel()
+            self.future = None
+        self.flush()
+
+
+def read_transcript(path: str) -> Iterator[dict[str, Any]]:
+    with gzip.open(path, "rt", encoding="utf-8") as fin:
+        try:
+            for line in fin:
+                if line.strip():
+                    yield json.loads(line)
+        except EOFError:
+            # The last member is cut short when the recording process died
+            logger.warning("Transcript %s is truncated", path)